@@ -0,0 +1,137 @@
+""" benchmark the resolution of LUIS datetimeV2 entities to query time ranges
+
+Compares the single pass thumbling.prometheus.get_query_time_ranges with the
+previous implementation, which grouped the entities first and parsed every
+value with strptime and iso8601 against a new current time.
+
+    $ python benchmarks/bench_datetime_resolver.py
+"""
+
+from datetime import datetime, timedelta
+import time
+import timeit
+
+import iso8601
+
+from thumbling.luis import group_datetimeV2_entities
+from thumbling.prometheus import (
+    get_limited_time_range,
+    get_query_time_ranges,
+    merge_time_ranges,
+)
+
+
+def str2timestamp_iso8601(t) -> int:
+    try:
+        return int(t)
+    except ValueError:
+        return int(iso8601.parse_date(t).timestamp())
+
+
+def get_query_time_ranges_previous(entities: list) -> list:
+    time_entities = group_datetimeV2_entities(entities)
+    time_ranges = []
+    for subtype in time_entities:
+        if subtype == "time":
+            for entity in time_entities[subtype]:
+                for value in entity:
+                    time_value = datetime.combine(
+                        datetime.today(),
+                        datetime.strptime(value["value"], "%H:%M:%S").time(),
+                    ).timestamp()
+                    time_range = get_limited_time_range(
+                        time_value - 300, time_value + 300
+                    )
+                    if time_range is not None:
+                        time_ranges.append(time_range)
+        elif subtype == "date":
+            for entity in time_entities[subtype]:
+                for value in entity:
+                    start_time = datetime.strptime(value["value"], "%Y-%m-%d")
+                    end_time = start_time + timedelta(days=1)
+                    time_range = get_limited_time_range(
+                        start_time.timestamp(), end_time.timestamp()
+                    )
+                    if time_range is not None:
+                        time_ranges.append(time_range)
+        elif subtype in ["daterange", "datetimerange"]:
+            for entity in time_entities[subtype]:
+                for value in entity:
+                    start_time = str2timestamp_iso8601(value["start"])
+                    end_time = str2timestamp_iso8601(
+                        value.get("end", int(time.time()))
+                    )
+                    time_range = get_limited_time_range(start_time, end_time)
+                    if time_range is not None:
+                        time_ranges.append(time_range)
+        elif subtype == "timerange":
+            for entity in time_entities[subtype]:
+                for value in entity:
+                    if "end" not in value:
+                        end_time = int(time.time())
+                    else:
+                        end_time = datetime.combine(
+                            datetime.today(),
+                            datetime.strptime(value["end"], "%H:%M:%S").time(),
+                        ).timestamp()
+                    start_time = datetime.combine(
+                        datetime.today(),
+                        datetime.strptime(value["start"], "%H:%M:%S").time(),
+                    ).timestamp()
+                    time_range = get_limited_time_range(start_time, end_time)
+                    if time_range is not None:
+                        time_ranges.append(time_range)
+    return merge_time_ranges(time_ranges)
+
+
+def create_entities() -> list:
+    """ the entities of a message like "problems with euler-p1 yesterday at 9:00,
+    last week and since 10:00"
+    """
+    yesterday = (datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+    week_start = (datetime.today() - timedelta(days=7)).strftime("%Y-%m-%d")
+    today = datetime.today().strftime("%Y-%m-%d")
+    return [
+        {"type": "instance", "entity": "euler-p1"},
+        {
+            "type": "builtin.datetimeV2.date",
+            "resolution": {"values": [{"value": yesterday}]},
+        },
+        {
+            "type": "builtin.datetimeV2.time",
+            "resolution": {"values": [{"value": "09:00:00"}]},
+        },
+        {
+            "type": "builtin.datetimeV2.daterange",
+            "resolution": {"values": [{"start": week_start, "end": today}]},
+        },
+        {
+            "type": "builtin.datetimeV2.datetimerange",
+            "resolution": {
+                "values": [
+                    {"start": f"{yesterday} 08:00:00", "end": f"{yesterday} 12:00:00"}
+                ]
+            },
+        },
+        {
+            "type": "builtin.datetimeV2.timerange",
+            "resolution": {"values": [{"start": "10:00:00"}]},
+        },
+    ]
+
+
+def main():
+    entities = create_entities()
+    print(f"{'implementation':>15} {'time [us]':>10}")
+    for name, function in [
+        ("previous", get_query_time_ranges_previous),
+        ("single pass", get_query_time_ranges),
+    ]:
+        timer = timeit.Timer(lambda: function(entities))
+        number, _ = timer.autorange()
+        result = min(timer.repeat(5, number)) / number * 1_000_000
+        print(f"{name:>15} {result:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
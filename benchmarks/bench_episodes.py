@@ -0,0 +1,60 @@
+""" benchmark the alert episode segmentation on long series
+
+Compares the vectorised segmentation of thumbling.matrix.find_episodes with a
+per-sample Python loop for series with 100k and more samples.
+
+    $ python benchmarks/bench_episodes.py
+"""
+
+from array import array
+import random
+import timeit
+
+from thumbling.matrix import find_episodes
+
+
+STEP = 60
+
+
+def find_episodes_loop(timestamps: array, step: int = STEP) -> list:
+    episodes = []
+    for timestamp in timestamps:
+        if episodes and timestamp - episodes[-1][1] <= step:
+            episodes[-1][1] = timestamp
+        else:
+            episodes.append([timestamp, timestamp])
+    return [tuple(episode) for episode in episodes]
+
+
+def create_timestamps(num_samples: int, gap_probability: float = 0.001) -> array:
+    random.seed(num_samples)
+    timestamps = array("d")
+    timestamp = 1540000000.0
+    for _ in range(num_samples):
+        timestamps.append(timestamp)
+        if random.random() < gap_probability:
+            timestamp += STEP * random.randint(2, 60)
+        else:
+            timestamp += STEP
+    return timestamps
+
+
+def main():
+    print(f"{'samples':>10} {'episodes':>9} {'loop [ms]':>10} {'numpy [ms]':>11}")
+    for num_samples in [100_000, 1_000_000, 5_000_000]:
+        timestamps = create_timestamps(num_samples)
+        episodes = find_episodes(timestamps, STEP)
+        assert episodes == find_episodes_loop(timestamps, STEP)
+        results = []
+        for function in [find_episodes_loop, find_episodes]:
+            timer = timeit.Timer(lambda: function(timestamps, STEP))
+            number, _ = timer.autorange()
+            results.append(min(timer.repeat(3, number)) / number * 1000)
+        print(
+            f"{num_samples:>10} {len(episodes):>9} "
+            f"{results[0]:>10.2f} {results[1]:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
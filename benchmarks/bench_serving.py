@@ -0,0 +1,174 @@
+""" benchmark the throughput of the bot app with one and several processes
+
+Starts prometheus_fake.py, a fake channel which accepts the replies of the bot
+and the bot with thumbling.launcher. A load generator sends concurrent
+messages which are recognised locally and answered with alert cards from
+the fake Prometheus, so no LUIS app is needed. The query cache is disabled,
+so every message queries Prometheus.
+
+    $ PYTHONPATH=src python benchmarks/bench_serving.py [requests] [concurrency]
+      [workers]
+
+The multi-process mode uses one worker per CPU by default.
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BOT_PORT = 8100
+CHANNEL_PORT = 8101
+PROMETHEUS_PORT = 9000
+
+
+def create_bot_file(directory: str) -> str:
+    with open(os.path.join(ROOT_PATH, "thumbling.bot")) as fo:
+        config = json.load(fo)
+    custom_services = []
+    for service in config["custom_services"]:
+        if service["type"] in ["turn_queue", "admission"]:
+            continue
+        if service["type"] == "prometheus":
+            service = {
+                **service,
+                "endpoint": f"http://localhost:{PROMETHEUS_PORT}",
+                "cacheTtl": 0,
+            }
+        custom_services.append(service)
+    config["custom_services"] = custom_services
+    bot_file_path = os.path.join(directory, "benchmark.bot")
+    with open(bot_file_path, "w") as fo:
+        json.dump(config, fo)
+    return bot_file_path
+
+
+async def start_channel() -> web.AppRunner:
+    """ a fake channel which accepts the replies of the bot
+    """
+
+    async def reply(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"id": "reply"})
+
+    app = web.Application()
+    app.add_routes(
+        [web.post("/v3/conversations/{conversation}/activities/{id}", reply)]
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", CHANNEL_PORT).start()
+    return runner
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    end = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < end:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} is not ready")
+
+
+async def generate_load(num_requests: int, concurrency: int) -> (float, list):
+    latencies = []
+    url = f"http://localhost:{BOT_PORT}/api/messages"
+    counter = iter(range(num_requests))
+
+    async def client(session: aiohttp.ClientSession):
+        for index in counter:
+            activity = {
+                "type": "message",
+                "id": str(index),
+                "text": "problems with euler today",
+                "channelId": "benchmark",
+                "serviceUrl": f"http://localhost:{CHANNEL_PORT}",
+                "conversation": {"id": f"conversation-{index}"},
+                "from": {"id": "user"},
+                "recipient": {"id": "bot"},
+            }
+            start = time.perf_counter()
+            async with session.post(url, json=activity) as resp:
+                await resp.read()
+                assert resp.status < 300, resp.status
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+    return duration, latencies
+
+
+async def run_benchmark(workers: int, num_requests: int, concurrency: int, env):
+    bot = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "thumbling.launcher",
+            f"--workers={workers}",
+            f"--port={BOT_PORT}",
+        ],
+        env=env,
+    )
+    try:
+        await wait_ready(f"http://localhost:{BOT_PORT}/ready")
+        # warm up every worker before measuring
+        await generate_load(4 * workers, 2 * workers)
+        duration, latencies = await generate_load(num_requests, concurrency)
+    finally:
+        bot.terminate()
+        bot.wait()
+    latencies.sort()
+    return (
+        num_requests / duration,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    )
+
+
+async def main(num_requests: int = 1000, concurrency: int = 32, workers: int = None):
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "botFilePath": create_bot_file(directory),
+            "botFileWatchInterval": "0",
+        }
+        prometheus = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_PATH, "prometheus_fake.py")]
+        )
+        channel = await start_channel()
+        try:
+            await wait_ready(
+                f"http://localhost:{PROMETHEUS_PORT}/api/v1/query_range"
+                "?query=ALERTS&start=0&end=60"
+            )
+            print(f"{'workers':>8} {'req/s':>8} {'p50 [ms]':>9} {'p99 [ms]':>9}")
+            for num_workers in sorted({1, workers or os.cpu_count()}):
+                throughput, p50, p99 = await run_benchmark(
+                    num_workers, num_requests, concurrency, env
+                )
+                print(f"{num_workers:>8} {throughput:>8.1f} {p50:>9.1f} {p99:>9.1f}")
+        finally:
+            await channel.cleanup()
+            prometheus.terminate()
+            prometheus.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
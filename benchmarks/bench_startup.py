@@ -0,0 +1,86 @@
+""" benchmark the cold start of the bot app
+
+Each run starts a fresh interpreter which imports thumbling.bot_server, starts
+the app with the thumbling.bot file and sends a first activity to it. The
+median times of the import, the app startup until it is ready and the first
+handled activity are printed.
+
+    $ PYTHONPATH=src python benchmarks/bench_startup.py [runs]
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+BOT_FILE_PATH = os.path.join(os.path.dirname(__file__), "..", "thumbling.bot")
+ACTIVITY = {
+    "type": "conversationUpdate",
+    "id": "1",
+    "channelId": "benchmark",
+    "serviceUrl": "http://localhost",
+    "conversation": {"id": "conversation"},
+    "from": {"id": "user"},
+    "recipient": {"id": "bot"},
+}
+
+
+async def measure_startup(import_start: float) -> dict:
+    from thumbling import bot_server
+
+    import_end = time.perf_counter()
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+
+    async with TestServer(bot_server.create_app()) as server:
+        ready_end = time.perf_counter()
+        async with ClientSession() as session:
+            url = server.make_url("/api/messages")
+            async with session.post(url, json=ACTIVITY) as resp:
+                assert resp.status == 201
+        activity_end = time.perf_counter()
+    return {
+        "import": import_end - import_start,
+        "startup": ready_end - import_end,
+        "first activity": activity_end - ready_end,
+        "total": activity_end - import_start,
+    }
+
+
+def run_child():
+    import_start = time.perf_counter()
+    print(json.dumps(asyncio.run(measure_startup(import_start))))
+
+
+def main(runs: int = 10):
+    env = {
+        **os.environ,
+        "botFilePath": BOT_FILE_PATH,
+        "botFileWatchInterval": "0",
+    }
+    results = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, __file__, "--child"],
+                env=env,
+                check=True,
+                stdout=subprocess.PIPE,
+            ).stdout
+        )
+        for _ in range(runs)
+    ]
+    print(f"{'phase':>15} {'median [ms]':>12}")
+    for phase in results[0]:
+        median = statistics.median(result[phase] for result in results) * 1000
+        print(f"{phase:>15} {median:>12.1f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--child"]:
+        run_child()
+    else:
+        main(*map(int, sys.argv[1:]))
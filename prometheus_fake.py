@@ -1,3 +1,4 @@
+import re
 import time
 
 from aiohttp import web
@@ -39,13 +40,24 @@ ALERTS = [
 ]
 
 
+SELECTOR_PATTERN = re.compile(r'(instance|service)(=~|=)"((?:[^"\\]|\\.)*)"')
+
+
+def is_selected(alert: dict, query: str) -> bool:
+    for label, operator, value in SELECTOR_PATTERN.findall(query):
+        # unescape the PromQL string
+        value = re.sub(r"\\(.)", r"\1", value)
+        if operator == "=" and alert[label] == value:
+            return True
+        if operator == "=~" and re.fullmatch(value, alert[label]):
+            return True
+    return False
+
+
 def get_alerts_in_range(query: str, start: int, end: int, step: int = 60) -> list:
     alerts_in_range = []
     for alert in ALERTS:
-        if (
-            f"service=\"{alert['service']}\"" not in query
-            and f"instance=\"{alert['instance']}\"" not in query
-        ):
+        if not is_selected(alert, query):
             continue
 
         for offset_pair in alert["alert_time_offsets"]:
@@ -77,11 +89,19 @@ def str2timestamp(t: str) -> int:
         return iso8601.parse_date(t).timestamp()
 
 
+def step2seconds(step: str) -> int:
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if step[-1] in units:
+        return int(step[:-1]) * units[step[-1]]
+    return int(float(step))
+
+
 async def query_range(request):
     if "start" in request.rel_url.query and "end" in request.rel_url.query:
         start = int(str2timestamp(request.rel_url.query["start"]))
         end = int(str2timestamp(request.rel_url.query["end"]))
-        alerts = get_alerts_in_range(request.rel_url.query["query"], start, end)
+        step = step2seconds(request.rel_url.query.get("step", "60"))
+        alerts = get_alerts_in_range(request.rel_url.query["query"], start, end, step)
     else:
         raise web.HTTPBadRequest(text="start and end required")
 
@@ -0,0 +1,108 @@
+""" admission control for incoming messages
+
+Every message can cause several Prometheus queries, so one chatty conversation
+or a burst of messages across many conversations can overload Prometheus.
+Messages are admitted by token buckets per conversation and per user. A
+message over the limits is answered at once with a short busy reply instead of
+calling LUIS and Prometheus.
+"""
+
+from collections import OrderedDict
+import time
+from typing import Callable, Hashable
+
+
+DEFAULT_ADMISSION_CONFIG = {
+    # messages per second and the number of messages which may come at once
+    "conversationRate": 0.5,
+    "conversationBurst": 5,
+    "userRate": 1.0,
+    "userBurst": 10,
+    # buckets of least recently seen conversations and users are dropped
+    "maxTrackedKeys": 10000,
+    "busyMessage": "\U000023F3 I am busy at the moment. Please try again shortly.",
+}
+
+
+class RateLimiter:
+    """ token buckets of a rate and burst size per key
+
+    The buckets are refilled lazily when a key is seen. The number of buckets is
+    bounded, a dropped bucket starts full again, as an idle one would be.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get_tokens(self, key: Hashable) -> float:
+        """ refill the bucket of the key and get its tokens
+        """
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket[0]
+
+    def consume(self, key: Hashable):
+        self._buckets[key][0] -= 1
+
+
+class AdmissionControl:
+    """ admit messages within the rate limits of their conversation and user
+
+    A message takes a token of both buckets, a rejected message takes none.
+    """
+
+    def __init__(
+        self, config: dict = None, clock: Callable[[], float] = time.monotonic
+    ):
+        config = {**DEFAULT_ADMISSION_CONFIG, **(config or {})}
+        self.busy_message = config["busyMessage"]
+        self.limiters = {
+            "conversation": RateLimiter(
+                config["conversationRate"],
+                config["conversationBurst"],
+                config["maxTrackedKeys"],
+                clock,
+            ),
+            "user": RateLimiter(
+                config["userRate"],
+                config["userBurst"],
+                config["maxTrackedKeys"],
+                clock,
+            ),
+        }
+
+    def check(self, activity) -> str:
+        """ take the tokens of an activity or get the limit which rejects it
+        """
+        keys = [
+            ("conversation", activity.conversation and activity.conversation.id),
+            ("user", activity.from_property and activity.from_property.id),
+        ]
+        keys = [(name, (activity.channel_id, key)) for name, key in keys if key]
+        for name, key in keys:
+            if self.limiters[name].get_tokens(key) < 1:
+                return name
+        for name, key in keys:
+            self.limiters[name].consume(key)
+        return None
@@ -1,83 +1,256 @@
 """ bot app and entry logic to handel incoming messages
 
 The module for the bot aiohttp app and the logic to handel incoming messages.
+It only imports aiohttp, so the app is created fast. The heavy dependencies
+like botbuilder are imported and the .bot file is loaded and decrypted in the
+on_startup hook of the app. The /ready endpoint tells if the bot is able to
+handle messages, e.g. for the health checks of a load balancer, and /metrics
+exposes the metrics of the bot in the Prometheus text format. With the
+adminToken app setting /admin/profile profiles the event loop of the app.
+Messages over the rate limits of the admission control are answered with a
+short busy reply before any LUIS request.
 
 To run the bot:
 
     $ python bot_server.py
 """
 
+import asyncio
+import hmac
 import os
 
 from aiohttp import web
-from botbuilder.schema import Activity
-from botbuilder.core import (
-    BotFrameworkAdapter,
-    BotFrameworkAdapterSettings,
-    TurnContext
-    # currently not used
-    # ConversationState,
-    # MemoryStorage
-    ,
-)
-
-from thumbling.conversation import handle_message
-from thumbling.utils import load_bot_file, get_service_config
-
-
-class ThumblingBotAdpaterSettings(BotFrameworkAdapterSettings):
-    """ extended adapter settings to have the bot config available in each TurnContext
-
-    With Adapter initialization the .bot configuration file is loaded as well,
-    and based on the environment the app settings provide to it.
-    The complete configuration is also stored in the config property.
-    """
-
-    def __init__(self):
-        self.config = load_bot_file(
-            os.getenv("botFilePath", default="./thumbling.bot"),
-            os.getenv("botFileSecret"),
-        )
-        self.environment = os.getenv("APP_ENVIRONMENT", default="development")
-        app_id = get_service_config(
-            self.config["services"], "endpoint", self.environment
-        )["appId"]
-        app_password = get_service_config(
-            self.config["services"], "endpoint", self.environment
-        )["appPassword"]
-        super().__init__(app_id, app_password)
 
 
-SETTINGS = ThumblingBotAdpaterSettings()
-ADAPTER = BotFrameworkAdapter(SETTINGS)
-
-# currently not used
-# memory = MemoryStorage()
-# conversation_state = ConversationState(memory)
-# ADAPTER.use(conversation_state)
+# created on app startup
+SETTINGS = None
+ADAPTER = None
+READY = False
+# the running profiler, only one profile is taken at a time
+PROFILER = None
+DEFAULT_PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 60
 
 
 async def unhandled_activity() -> web.Response:
     return web.Response(status=404)
 
 
-async def request_handler(context: TurnContext) -> web.Response:
+async def request_handler(context) -> web.Response:
+    from thumbling.conversation import handle_message
+
     if context.activity.type == "message":
         return await handle_message(context)
     else:
         return await unhandled_activity()
 
 
-async def messages(req: web.web_request) -> web.Response:
+def admit(handler):
+    """ wrap a turn handler to answer messages over the rate limits at once
+    """
+    admission = SETTINGS.admission
+    if admission is None:
+        return handler
+
+    async def admission_handler(context):
+        if context.activity.type == "message":
+            limit = admission.check(context.activity)
+            if limit is not None:
+                from thumbling.conversation import handle_unrecognized_intent
+
+                SETTINGS.metrics.rejected_turns.inc(limit)
+                # answered at once without calling LUIS or Prometheus
+                return await handle_unrecognized_intent(context, admission.busy_message)
+        return await handler(context)
+
+    return admission_handler
+
+
+async def messages(req: web.Request) -> web.Response:
+    from botbuilder.schema import Activity
+
+    if not READY:
+        return web.Response(status=503, headers={"Retry-After": "1"})
     body = await req.json()
     activity = Activity().deserialize(body)
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
-    return await ADAPTER.process_activity(activity, auth_header, request_handler)
+    turn_queue = SETTINGS.turn_queue
+    if turn_queue is not None and activity.type == "message":
+        return await queue_activity(turn_queue, activity, auth_header)
+    response = await ADAPTER.process_activity(
+        activity, auth_header, admit(request_handler)
+    )
+    if response is not None:
+        return web.json_response(data=response.body, status=response.status)
+    return web.Response(status=201)
+
+
+async def queue_activity(turn_queue, activity, auth_header: str) -> web.Response:
+    """ authenticate and queue a message to answer it proactively
+
+    The channel gets its response at once, or 503 with a Retry-After header if
+    the queue is full. Messages over the rate limits are answered at once and
+    not queued.
+    """
+    from thumbling.turn_queue import QueueFullError
+
+    busy_response = web.Response(
+        status=503, headers={"Retry-After": str(turn_queue.retry_after)}
+    )
+    if turn_queue.full():
+        return busy_response
+    try:
+        await ADAPTER.process_activity(activity, auth_header, admit(turn_queue.submit))
+    except QueueFullError:
+        return busy_response
+    return web.Response(status=202)
+
+
+async def ready(req: web.Request) -> web.Response:
+    if not READY:
+        return web.json_response({"status": "unavailable"}, status=503)
+    return web.json_response({"status": "ready"})
+
+
+async def metrics(req: web.Request) -> web.Response:
+    if SETTINGS is None:
+        return web.Response(status=503)
+    from thumbling.metrics import CONTENT_TYPE
+
+    return web.Response(
+        body=SETTINGS.metrics.render().encode(),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+def is_admin(req: web.Request) -> bool:
+    admin_token = os.getenv("adminToken")
+    if not admin_token:
+        return False
+    authorization = req.headers.get("Authorization", "")
+    return hmac.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode())
+
+
+async def profile(req: web.Request) -> web.Response:
+    """ profile the event loop for the given seconds and return the stacks
+
+    The stacks are returned in the collapsed format of the flame graph tools.
+    """
+    global PROFILER
+    from thumbling.profiler import SamplingProfiler
+
+    if not is_admin(req):
+        return web.Response(status=401)
+    try:
+        seconds = float(req.query.get("seconds", DEFAULT_PROFILE_SECONDS))
+    except ValueError:
+        return web.Response(status=400, text="seconds has to be a number")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return web.Response(
+            status=400, text=f"seconds has to be at most {MAX_PROFILE_SECONDS}"
+        )
+    if PROFILER is not None:
+        return web.Response(status=409, text="a profile is taken already")
+    PROFILER = SamplingProfiler()
+    PROFILER.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler, PROFILER = PROFILER, None
+        profiler.stop()
+    return web.Response(text=profiler.collapsed())
+
+
+async def load_settings(app: web.Application):
+    global SETTINGS, ADAPTER
+    from botbuilder.core import BotFrameworkAdapter
+    from thumbling.settings import ThumblingBotAdpaterSettings
+
+    SETTINGS = ThumblingBotAdpaterSettings()
+    ADAPTER = BotFrameworkAdapter(SETTINGS)
+    # currently not used
+    # memory = MemoryStorage()
+    # conversation_state = ConversationState(memory)
+    # ADAPTER.use(conversation_state)
+
+
+async def start_client_session(app: web.Application):
+    from thumbling.http_client import create_client_session
+
+    SETTINGS.client_session = create_client_session(SETTINGS.http_client_config)
+
+
+async def close_client_session(app: web.Application):
+    if SETTINGS.client_session is not None:
+        await SETTINGS.client_session.close()
+        SETTINGS.client_session = None
+
+
+async def start_config_watch(app: web.Application):
+    if SETTINGS.watch_interval > 0:
+        SETTINGS.config_watch = asyncio.ensure_future(
+            SETTINGS.config_registry.watch(SETTINGS.watch_interval)
+        )
+
+
+async def stop_config_watch(app: web.Application):
+    if SETTINGS.config_watch is not None:
+        SETTINGS.config_watch.cancel()
+        SETTINGS.config_watch = None
+
+
+async def start_turn_queue(app: web.Application):
+    from thumbling.turn_queue import TurnQueue
+
+    if SETTINGS.turn_queue_config:
+        SETTINGS.turn_queue = TurnQueue(
+            ADAPTER, request_handler, SETTINGS.turn_queue_config
+        )
+        SETTINGS.turn_queue.start()
+
+
+async def stop_turn_queue(app: web.Application):
+    if SETTINGS.turn_queue is not None:
+        await SETTINGS.turn_queue.stop()
+        SETTINGS.turn_queue = None
+
+
+async def set_ready(app: web.Application):
+    global READY
+    READY = True
+
+
+async def set_unavailable(app: web.Application):
+    global READY
+    READY = False
+
+
+def create_app() -> web.Application:
+    """ create the bot app, the bot is set up when the app starts
+    """
+    app = web.Application()
+    # we use "/api/messages" as it seems to be the "standard" URL used by bots
+    app.add_routes(
+        [
+            web.post("/api/messages", messages),
+            web.get("/ready", ready),
+            web.get("/metrics", metrics),
+            web.get("/admin/profile", profile),
+        ]
+    )
+    app.on_startup.append(load_settings)
+    app.on_startup.append(start_client_session)
+    app.on_startup.append(start_config_watch)
+    app.on_startup.append(start_turn_queue)
+    app.on_startup.append(set_ready)
+    app.on_shutdown.append(set_unavailable)
+    app.on_shutdown.append(stop_turn_queue)
+    app.on_cleanup.append(close_client_session)
+    app.on_cleanup.append(stop_config_watch)
+    return app
 
 
-# we use "/api/messages" as it seems to be the "standard" URL used by bots
-app = web.Application()
-app.add_routes([web.post("/api/messages", messages)])
+app = create_app()
 
 
 # for simple local execution only
@@ -0,0 +1,204 @@
+""" caches for the results of backend requests
+
+The module provides size bounded caches with a time to live per entry in two
+backends: TTLCache keeps the least recently used entries in the memory of the
+process and SQLiteCache keeps the latest entries in a SQLite database on local
+disk, which is shared by all worker processes of the bot. Both keep hit and
+miss counters so their usefulness can be checked.
+"""
+
+from collections import OrderedDict
+import os
+import pickle
+import sqlite3
+import time
+from typing import Any, Callable, Hashable
+
+from thumbling.utils import BotConfigError
+
+
+DEFAULT_SQLITE_PATH = "thumbling-cache.sqlite"
+# seconds to wait for the write lock of another process
+SQLITE_BUSY_TIMEOUT = 0.02
+
+
+class Cache:
+    """ the interface of the cache backends
+
+    Entries without a time to live stay in the cache until they are evicted
+    to keep the size bound.
+    """
+
+    hits = 0
+    misses = 0
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+class TTLCache(Cache):
+    """ a size bounded LRU cache with a time to live per entry in memory
+
+    The values are stored as they are, so they are shared by all users.
+    """
+
+    def __init__(
+        self, max_size: int = 256, clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires is None or expires > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        expires = None if ttl is None else self.clock() + ttl
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCache(Cache):
+    """ a size bounded cache with a time to live per entry in SQLite
+
+    The database uses write-ahead logging, so the worker processes can read it
+    while one of them writes. Reads do not write, so the oldest entries are
+    evicted instead of the least recently used ones. The cache is used in the
+    event loop, so it waits only briefly for the lock of another writer and
+    treats a busy database as a miss or skips the write. Keys are stored by
+    their repr, so they have to be tuples of strings and numbers, and values
+    are pickled. Each cache has its own table, several caches can share one
+    database file. The expiry uses the wall clock, as it has to be the same in
+    all processes.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_SQLITE_PATH,
+        table: str = "cache",
+        max_size: int = 256,
+        clock: Callable[[], float] = time.time,
+    ):
+        if not table.isidentifier():
+            raise ValueError(f"invalid cache table name {table}")
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # reads and writes which were given up as the database was busy
+        self.busy = 0
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections must not be shared with forked processes
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value BLOB, expires REAL, stored REAL)"
+            )
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_stored "
+                f"ON {self.table} (stored)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def __len__(self) -> int:
+        (size,) = self.connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}"
+        ).fetchone()
+        return size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            row = self.connection.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (repr(key),)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            self.busy += 1
+            row = None
+        if row is not None:
+            value, expires = row
+            if expires is None or expires > self.clock():
+                self.hits += 1
+                return pickle.loads(value)
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        now = self.clock()
+        expires = None if ttl is None else now + ttl
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            connection = self.connection
+            # the insert and the eviction of expired and the oldest entries are
+            # one transaction, so concurrent writers do not evict too much
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                    (repr(key), data, expires, now),
+                )
+                connection.execute(
+                    f"DELETE FROM {self.table} WHERE expires <= ?", (now,)
+                )
+                connection.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM "
+                    f"{self.table} ORDER BY stored DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                )
+        except sqlite3.OperationalError:
+            self.busy += 1
+
+    def stats(self) -> dict:
+        return {**super().stats(), "busy": self.busy}
+
+
+def create_cache(cache_config: dict, name: str, max_size: int) -> Cache:
+    """ create a cache with the backend of the cache custom service config
+
+    The name tells the caches apart which share a backend.
+    """
+    backend = cache_config.get("backend", "memory")
+    if backend == "memory":
+        return TTLCache(max_size)
+    if backend == "sqlite":
+        return SQLiteCache(
+            cache_config.get("path", DEFAULT_SQLITE_PATH), name, max_size
+        )
+    raise BotConfigError(f"unknown cache backend {backend}")
@@ -8,6 +8,8 @@ For more information, docu and designer see https://adaptivecards.io/
 import copy
 from datetime import datetime
 
+from thumbling.matrix import AlertSeries, Num
+
 
 BASE_ADAPTIVE_CARD = {
     "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
@@ -16,22 +18,32 @@ BASE_ADAPTIVE_CARD = {
 }
 
 
-def create_simple_alert_card(alerts: list, start: int, end: int) -> dict:
+def create_simple_alert_card(
+    alerts: list, start: int, end: int, step: Num = 60
+) -> dict:
+    """ create a card with the time span of each episode an alert was firing
+
+    The alerts are AlertSeries, their AlertSummary or series of a matrix result.
+    The step of the query is the maximal distance of samples of one episode.
+    """
     container_items = []
     for alert in alerts:
-        timestamps = [value[0] for value in alert["values"]]
-        min_time = datetime.fromtimestamp(min(timestamps))
-        max_time = datetime.fromtimestamp(max(timestamps))
-        container_items.append(
-            {"type": "TextBlock", "wrap": True, "text": f"{min_time} - {max_time}"}
-        )
-        container_items.append(
-            {
-                "type": "TextBlock",
-                "horizontalAlignment": "right",
-                "text": f"{alert['metric']['alertname']}",
-            }
-        )
+        if isinstance(alert, dict):
+            alert = AlertSeries.from_dict(alert)
+        summary = alert.summarize(step)
+        for episode_start, episode_end in summary.episodes:
+            min_time = datetime.fromtimestamp(episode_start)
+            max_time = datetime.fromtimestamp(episode_end)
+            container_items.append(
+                {"type": "TextBlock", "wrap": True, "text": f"{min_time} - {max_time}"}
+            )
+            container_items.append(
+                {
+                    "type": "TextBlock",
+                    "horizontalAlignment": "right",
+                    "text": f"{summary.metric['alertname']}",
+                }
+            )
     card = copy.copy(BASE_ADAPTIVE_CARD)
     start_time = datetime.fromtimestamp(start)
     end_time = datetime.fromtimestamp(end)
@@ -0,0 +1,117 @@
+""" indexed and hot-reloadable configuration of the bot services
+
+The .bot file is loaded and its secrets are decrypted once per change of the
+file. The service entries are indexed by type and name, so a service config is
+found without scanning the service lists on every message. The registry polls
+the file for changes and swaps in a new snapshot at once, so endpoint or key
+rotations take effect without a restart. Turns which already took the previous
+snapshot finish with it.
+"""
+
+import asyncio
+from collections import defaultdict
+import logging
+import os
+from typing import Callable
+
+from thumbling.utils import (
+    get_optional_service_config,
+    get_service_config,
+    load_bot_file,
+)
+
+
+DEFAULT_WATCH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigSnapshot:
+    """ one loaded configuration with its services indexed by (type, name)
+
+    A snapshot must not be changed after it was created.
+    """
+
+    def __init__(self, config: dict, version: tuple = None):
+        self.config = config
+        self.version = version
+        self._index = {}
+        for section in ["services", "custom_services"]:
+            index = defaultdict(list)
+            for service in config.get(section, []):
+                index[(service["type"], service["name"])].append(service)
+            self._index[section] = dict(index)
+
+    def get_services(self, section: str, service_type: str, name: str) -> list:
+        return self._index.get(section, {}).get((service_type, name), [])
+
+    def get_service_config(self, section: str, service_type: str, name: str) -> dict:
+        """ get the service config entry which has to exist exactly once
+        """
+        services = self.get_services(section, service_type, name)
+        return get_service_config(services, service_type, name)
+
+    def get_optional_service_config(
+        self, section: str, service_type: str, name: str
+    ) -> dict:
+        """ get a service config entry or an empty config if there is none
+        """
+        services = self.get_services(section, service_type, name)
+        return get_optional_service_config(services, service_type, name)
+
+
+class ConfigRegistry:
+    """ the current configuration snapshot of a .bot file
+
+    Listeners are called with each newly loaded snapshot before it becomes
+    active, they can reject it by raising an exception. A file which can not be
+    loaded, e.g. while it is written, keeps the previous snapshot active.
+    """
+
+    def __init__(
+        self, file_path: str = None, secret: str = None, config: dict = None
+    ):
+        self.file_path = file_path
+        self.secret = secret
+        self.listeners = []
+        self.reload_errors = 0
+        if config is not None:
+            self.snapshot = ConfigSnapshot(config)
+        else:
+            self.snapshot = self.load()
+
+    def get_file_version(self) -> tuple:
+        stat = os.stat(self.file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> ConfigSnapshot:
+        version = self.get_file_version()
+        return ConfigSnapshot(load_bot_file(self.file_path, self.secret), version)
+
+    def add_listener(self, listener: Callable[[ConfigSnapshot], None]):
+        self.listeners.append(listener)
+
+    def reload_if_changed(self) -> bool:
+        """ load the file if it changed and return if a new snapshot is active
+        """
+        if self.file_path is None:
+            return False
+        try:
+            if self.get_file_version() == self.snapshot.version:
+                return False
+            snapshot = self.load()
+            for listener in self.listeners:
+                listener(snapshot)
+        except Exception:
+            self.reload_errors += 1
+            logger.exception("could not reload the bot file %s", self.file_path)
+            return False
+        self.snapshot = snapshot
+        return True
+
+    async def watch(self, interval: float = DEFAULT_WATCH_INTERVAL):
+        """ reload the file on changes until the task is cancelled
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.reload_if_changed()
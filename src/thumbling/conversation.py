@@ -5,14 +5,29 @@ responses
 """
 
 
-import aiohttp
+import asyncio
+import contextlib
+import logging
+import time
+
+import aiohttp.web
 from botbuilder.core import TurnContext, CardFactory
 from botbuilder.schema import Activity, ActivityTypes, Attachment
 
 from thumbling.cards import create_simple_alert_card
-from thumbling.luis import get_message_intent
+from thumbling.luis import LuisError, get_message_intent
 from thumbling import prometheus
-from thumbling.utils import get_service_config
+from thumbling.prefetch import SpeculativePrefetch, start_speculative_prefetch
+from thumbling.query_frontend import QueryFrontend
+from thumbling.resilience import CircuitOpenError
+from thumbling import tracing
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_QUERIES = 4
+# seconds a turn may take until its LUIS and Prometheus requests time out
+DEFAULT_TURN_TIMEOUT = 10
 
 
 async def create_reply_activity(
@@ -32,82 +47,317 @@ async def create_reply_activity(
     return activity
 
 
-async def handle_problem_intent(context: TurnContext, message_intent: dict):
+@contextlib.contextmanager
+def record_stage(context: TurnContext, stage: str, **attributes):
+    """ record the duration of a stage of the turn as metric and as span
+    """
+    with context.adapter.settings.metrics.stage_duration.time(stage):
+        with tracing.span(stage, **attributes):
+            yield
+
+
+async def send_activity(context: TurnContext, activity: Activity):
+    """ send an activity and record the duration of the send
+    """
+    with record_stage(context, "send_activity"):
+        await context.send_activity(activity)
+
+
+def get_turn_deadline(prometheus_config: dict) -> float:
+    """ get the time.monotonic() timestamp the turn has to be finished by
+    """
+    return time.monotonic() + prometheus_config.get(
+        "turnTimeout", DEFAULT_TURN_TIMEOUT
+    )
+
+
+async def create_alert_responses(
+    context: TurnContext,
+    prometheus_api: QueryFrontend,
+    coalesced_query: tuple,
+    label: str,
+    time_range: tuple,
+    semaphore: asyncio.Semaphore,
+    deadline: float,
+    prefetched: asyncio.Future = None,
+) -> list:
+    """ query the alerts for one time range and create the response activities
+
+    The coalesced query selects the alerts of several label values at once,
+    its result is split again to create one response per label value.
+    The result of an already running prefetched query is used if given.
+    Errors and invalid results are turned into an error response so a failing
+    query does not affect the other queries of the same message.
+    """
+    metrics = context.adapter.settings.metrics
+    query_string, values = coalesced_query
+    step = prometheus_api.get_query_step(*time_range)
+    try:
+        if prefetched is not None:
+            result = await prefetched
+        else:
+            async with semaphore:
+                with record_stage(
+                    context, "query_range", query=query_string, step=step
+                ):
+                    result = await prometheus_api.query_range(
+                        query_string,
+                        start=time_range[0],
+                        end=time_range[1],
+                        step=step,
+                        deadline=deadline,
+                    )
+        if result.get("status") == "success":
+            results = prometheus.split_result_by_label(
+                result["data"]["result"], label, values
+            )
+    except CircuitOpenError:
+        metrics.errors.inc("query_range")
+        return [
+            await create_reply_activity(
+                context.activity,
+                "\U000026A0 The Prometheus server is not available at the moment. "
+                "Please try again later.",
+            )
+        ]
+    except aiohttp.client_exceptions.ClientConnectorError:
+        metrics.errors.inc("query_range")
+        return [
+            await create_reply_activity(
+                context.activity,
+                "\U000026A0 There was a problem connecting the Prometheus server.",
+            )
+        ]
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        metrics.errors.inc("query_range")
+        return [
+            await create_reply_activity(
+                context.activity,
+                "\U000026A0 There was a problem querying the Prometheus server.",
+            )
+        ]
+    except (KeyError, ValueError):
+        # e.g. a truncated JSON body or a result without the expected fields
+        logger.exception("invalid result of the query %s", query_string)
+        metrics.errors.inc("query_range")
+        return [
+            await create_reply_activity(
+                context.activity,
+                "\U000026A0 There was a problem querying the Prometheus server.",
+            )
+        ]
+
+    if result.get("status") != "success":
+        metrics.errors.inc("query_range")
+        return [
+            await create_reply_activity(
+                context.activity,
+                "\U000026A0 There was a problem querying the Prometheus server.",
+            )
+        ]
+    responses = []
+    for value in values:
+        with record_stage(context, "create_simple_alert_card", value=value):
+            card = create_simple_alert_card(
+                results[value], *time_range, step=prometheus.duration2seconds(step)
+            )
+        responses.append(
+            await create_reply_activity(
+                context.activity,
+                "There were the following alerts:",
+                attachment=CardFactory.adaptive_card(card),
+            )
+        )
+    return responses
+
+
+def create_prometheus_api(context: TurnContext, prometheus_config: dict):
+    """ create the Prometheus API with the shared client session, cache and policies
+
+    Identical queries of concurrent turns are sent once with the shared singleflight.
+    """
+    return QueryFrontend(
+        prometheus.PrometheusAPI(
+            prometheus_config,
+            session=context.adapter.settings.client_session,
+            cache=context.adapter.settings.query_cache,
+            latency_tracker=context.adapter.settings.prometheus_latencies,
+            resilience=context.adapter.settings.resilience["prometheus"],
+            singleflight=context.adapter.settings.query_singleflight,
+            query_limiter=context.adapter.settings.query_limiter,
+        ),
+        prometheus_config,
+    )
+
+
+async def handle_problem_intent(
+    context: TurnContext,
+    message_intent: dict,
+    deadline: float = None,
+    prefetch: SpeculativePrefetch = None,
+    prometheus_config: dict = None,
+):
     """ if a message was categorized as a problem get the Prometheus alerts and respond
 
     Based on the intent entities create the Prometheus queries and time range.
     With the result create the message card for the response.
     Send one message(card) per instance/service entity and time range.
+    The entities of one time range are requested with coalesced queries which
+    run concurrently, limited by the maxConcurrentQueries setting of the
+    prometheus service, but the responses are sent in a stable order.
+    The queries have to finish before the deadline of the turn, a
+    time.monotonic() timestamp, by default the turnTimeout of the prometheus
+    service from now on. Matching queries of a speculative prefetch are used
+    instead of sending them again.
+    The prometheus service config of the configuration snapshot the turn took
+    should be passed in, otherwise it is taken from the current snapshot.
     """
-    prometheus_config = get_service_config(
-        context.adapter.settings.config["custom_services"],
-        "prometheus",
-        context.adapter.settings.environment,
-    )
-    prometheus_api = prometheus.PrometheusAPI(prometheus_config)
-    query_strings = prometheus.get_alert_queries(message_intent["entities"])
-    if not query_strings:
+    if prometheus_config is None:
+        config = context.adapter.settings.config_registry.snapshot
+        prometheus_config = config.get_service_config(
+            "custom_services", "prometheus", context.adapter.settings.environment
+        )
+    prometheus_api = create_prometheus_api(context, prometheus_config)
+    label, values = prometheus.get_alert_selectors(message_intent["entities"])
+    if not values:
         await handle_unrecognized_intent(
             context,
             "Sorry, I was not able to determine which service you have a problem with.",
         )
+    coalesced_queries = prometheus.get_coalesced_alert_queries(
+        label,
+        values,
+        prometheus_config.get("maxSelectorLength", prometheus.MAX_SELECTOR_LENGTH),
+    )
     time_ranges = prometheus.get_query_time_ranges(message_intent["entities"])
 
-    for time_range in time_ranges:
-        for query_string in query_strings:
-            try:
-                result = await prometheus_api.query_range(
-                    query_string, start=time_range[0], end=time_range[1]
-                )
-                card = create_simple_alert_card(result["data"]["result"], *time_range)
-                response = await create_reply_activity(
-                    context.activity,
-                    "There were the following alerts:",
-                    attachment=CardFactory.adaptive_card(card),
-                )
-            except aiohttp.client_exceptions.ClientConnectorError:
-                response = await create_reply_activity(
-                    context.activity,
-                    "\U000026A0 There was a problem connecting the Prometheus server.",
-                )
-            await context.send_activity(response)
+    semaphore = asyncio.Semaphore(
+        prometheus_config.get("maxConcurrentQueries", DEFAULT_MAX_CONCURRENT_QUERIES)
+    )
+    if deadline is None:
+        deadline = get_turn_deadline(prometheus_config)
+    response_tasks = [
+        asyncio.ensure_future(
+            create_alert_responses(
+                context,
+                prometheus_api,
+                coalesced_query,
+                label,
+                time_range,
+                semaphore,
+                deadline,
+                prefetch.take(coalesced_query[0], time_range) if prefetch else None,
+            )
+        )
+        for time_range in time_ranges
+        for coalesced_query in coalesced_queries
+    ]
+    try:
+        for response_task in response_tasks:
+            for response in await response_task:
+                await send_activity(context, response)
+    finally:
+        for response_task in response_tasks:
+            response_task.cancel()
 
 
 async def handle_unrecognized_intent(context: TurnContext, message: str):
     response = await create_reply_activity(context.activity, message)
-    await context.send_activity(response)
+    await send_activity(context, response)
 
 
 async def handle_initial_message(context: TurnContext) -> aiohttp.web.Response:
-    luis_service_config = get_service_config(
-        context.adapter.settings.config["services"], "luis", "production"
-    )
-    # TODO handel the LuisError exception for too long messages
-    message_intent = await get_message_intent(
-        luis_service_config, context.activity.text
+    config = context.adapter.settings.config_registry.snapshot
+    prometheus_config = config.get_service_config(
+        "custom_services", "prometheus", context.adapter.settings.environment
     )
-    if (
-        "topScoringIntent" in message_intent
-        and message_intent["topScoringIntent"]["intent"] == "problem"
-        and message_intent["topScoringIntent"]["score"] >= 0.8
-    ):
-        await handle_problem_intent(context, message_intent)
-    else:
-        await handle_unrecognized_intent(
-            context, "Sorry, I did not understand. Please rephrase your concern."
-        )
+    deadline = get_turn_deadline(prometheus_config)
+    luis_service_config = config.get_service_config("services", "luis", "production")
+    metrics = context.adapter.settings.metrics
+    message_intent = None
+    prefetch = None
+    recognizer = context.adapter.settings.recognizer
+    if recognizer is not None:
+        # simple questions about known services do not need the LUIS round trip
+        message_intent = recognizer.recognize(context.activity.text)
+        if message_intent is not None:
+            metrics.intents.inc("problem", "local")
+        elif prometheus_config.get("speculativePrefetch", False):
+            # query the alerts of the services in the message while LUIS is asked
+            prefetch = start_speculative_prefetch(
+                create_prometheus_api(context, prometheus_config),
+                prometheus_config,
+                recognizer.find_target_entities(context.activity.text),
+                deadline,
+            )
+    try:
+        if message_intent is None:
+            try:
+                with record_stage(context, "get_message_intent"):
+                    message_intent = await get_message_intent(
+                        luis_service_config,
+                        context.activity.text,
+                        session=context.adapter.settings.client_session,
+                        resilience=context.adapter.settings.resilience["luis"],
+                        deadline=deadline,
+                        cache=context.adapter.settings.intent_cache,
+                        singleflight=context.adapter.settings.intent_singleflight,
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
+                metrics.errors.inc("get_message_intent")
+                await handle_unrecognized_intent(
+                    context,
+                    "\U000026A0 Sorry, I can not understand messages at the moment. "
+                    "Please try again later.",
+                )
+                return
+            except LuisError:
+                await handle_unrecognized_intent(
+                    context,
+                    "Sorry, your message is too long for me. "
+                    "Please ask a shorter question.",
+                )
+                return
+            top_scoring_intent = message_intent.get("topScoringIntent", {})
+            metrics.intents.inc(top_scoring_intent.get("intent", "None"), "luis")
+        if (
+            "topScoringIntent" in message_intent
+            and message_intent["topScoringIntent"]["intent"] == "problem"
+            and message_intent["topScoringIntent"]["score"] >= 0.8
+        ):
+            await handle_problem_intent(
+                context, message_intent, deadline, prefetch, prometheus_config
+            )
+        else:
+            await handle_unrecognized_intent(
+                context, "Sorry, I did not understand. Please rephrase your concern."
+            )
+    finally:
+        if prefetch is not None:
+            prefetch.cancel()
 
 
 async def handle_conversation_update(context: TurnContext) -> aiohttp.web.Resource:
     message = "conversation update not implemented yet"
     response = await create_reply_activity(context.activity, message)
-    await context.send_activity(response)
+    await send_activity(context, response)
 
 
 # entry point from the bot_server app
 async def handle_message(context: TurnContext) -> aiohttp.web.Response:
-    if not context.responded:
-        await handle_initial_message(context)
-    else:
-        await handle_conversation_update(context)
+    metrics = context.adapter.settings.metrics
+    metrics.turns_in_flight.inc()
+    try:
+        with metrics.turn_duration.time(), context.adapter.settings.tracer.turn(
+            context.activity.id, conversation=context.activity.conversation.id
+        ):
+            if not context.responded:
+                await handle_initial_message(context)
+            else:
+                await handle_conversation_update(context)
+    except Exception:
+        metrics.errors.inc("turn")
+        raise
+    finally:
+        metrics.turns_in_flight.dec()
     return aiohttp.web.Response(status=202)
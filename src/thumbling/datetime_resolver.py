@@ -0,0 +1,155 @@
+""" resolve LUIS datetimeV2 entities to Prometheus query time ranges
+
+All datetimeV2 subtypes of an intent are resolved in a single pass over the
+entities against one captured "now", so the time ranges of one message are
+consistent with each other. The LUIS payload is only read, never changed.
+Times and dates without a timezone are local ones like LUIS resolves them.
+"""
+
+from datetime import date, datetime, time as datetime_time, timedelta
+from functools import lru_cache
+import re
+import time
+
+from thumbling.utils import str2timestamp
+
+
+DATETIME_TYPE_PREFIX = "builtin.datetimeV2."
+# seconds around a point in time which are queried for it
+TIME_WINDOW = 300
+# seconds before the end which are queried for ranges without a start
+OPEN_RANGE_LENGTH = 86400
+SAFETY_MARGIN = 30
+
+TIMEX_DURATION_PATTERN = re.compile(
+    r"P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?"
+    r"(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?"
+)
+TIMEX_DURATION_UNITS = (365 * 86400, 30 * 86400, 7 * 86400, 86400, 3600, 60, 1)
+
+
+class DatetimeResolver:
+    """ resolve datetimeV2 entities against a fixed "now" timestamp
+    """
+
+    def __init__(self, now: float = None, safety: int = SAFETY_MARGIN):
+        self.now = time.time() if now is None else now
+        self.today = datetime.fromtimestamp(self.now).date()
+        self.safety = safety
+        self.resolvers = {
+            "date": self.resolve_date,
+            "time": self.resolve_time,
+            "daterange": self.resolve_range,
+            "datetimerange": self.resolve_range,
+            "timerange": self.resolve_timerange,
+            "datetime": self.resolve_datetime,
+            "duration": self.resolve_duration,
+            "set": self.resolve_set,
+        }
+
+    def resolve(self, entities: list) -> list:
+        """ get the time ranges of all datetimeV2 entities in the past
+
+        Ranges are cut off at the "now" timestamp minus a safety margin, as
+        Prometheus does not allow timestamps in its future.
+        """
+        time_ranges = []
+        for entity in entities:
+            if not entity["type"].startswith(DATETIME_TYPE_PREFIX):
+                continue
+            resolver = self.resolvers.get(entity["type"][len(DATETIME_TYPE_PREFIX) :])
+            if resolver is None:
+                continue
+            for value in entity["resolution"]["values"]:
+                time_range = resolver(value)
+                if time_range is not None:
+                    time_range = self.limit(*time_range)
+                if time_range is not None:
+                    time_ranges.append(time_range)
+        return time_ranges
+
+    def limit(self, start: float, end: float) -> tuple:
+        """ limit a time range to the past or return None if nothing is left
+        """
+        latest = self.now - self.safety
+        start, end = min(start, latest), min(end, latest)
+        if start >= end:
+            return None
+        return int(start), int(end)
+
+    def get_time_of_today(self, value: str) -> float:
+        return datetime.combine(self.today, parse_time(value)).timestamp()
+
+    def resolve_date(self, value: dict) -> tuple:
+        start = datetime.combine(parse_date(value["value"]), datetime_time())
+        return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+    def resolve_time(self, value: dict) -> tuple:
+        time_value = self.get_time_of_today(value["value"])
+        return time_value - TIME_WINDOW, time_value + TIME_WINDOW
+
+    def resolve_datetime(self, value: dict) -> tuple:
+        time_value = str2timestamp(value["value"])
+        return time_value - TIME_WINDOW, time_value + TIME_WINDOW
+
+    def resolve_range(self, value: dict) -> tuple:
+        end = str2timestamp(value["end"]) if "end" in value else self.now
+        start = (
+            str2timestamp(value["start"])
+            if "start" in value
+            else end - OPEN_RANGE_LENGTH
+        )
+        return start, end
+
+    def resolve_timerange(self, value: dict) -> tuple:
+        end = self.get_time_of_today(value["end"]) if "end" in value else self.now
+        start = (
+            self.get_time_of_today(value["start"])
+            if "start" in value
+            else end - OPEN_RANGE_LENGTH
+        )
+        return start, end
+
+    def resolve_duration(self, value: dict) -> tuple:
+        # a duration like "for 3 hours" is taken as the time until now
+        return self.now - float(value["value"]), self.now
+
+    def resolve_set(self, value: dict) -> tuple:
+        # a set like "hourly" or "every day" is taken as its last period
+        seconds = timex_duration2seconds(value.get("timex", ""))
+        if not seconds:
+            return None
+        return self.now - seconds, self.now
+
+
+def resolve_time_ranges(entities: list, now: float = None) -> list:
+    """ get the time ranges of the datetimeV2 entities of an intent
+    """
+    return DatetimeResolver(now).resolve(entities)
+
+
+@lru_cache(maxsize=1024)
+def parse_time(value: str) -> datetime_time:
+    """ parse a "%H:%M:%S" time of day, memoised as LUIS values repeat a lot
+    """
+    return datetime_time.fromisoformat(value)
+
+
+@lru_cache(maxsize=1024)
+def parse_date(value: str) -> date:
+    """ parse a "%Y-%m-%d" date, memoised as LUIS values repeat a lot
+    """
+    return date.fromisoformat(value)
+
+
+def timex_duration2seconds(timex: str) -> int:
+    """ convert a TIMEX duration like "P1D" or "PT2H" to seconds, 0 if it is none
+    """
+    match = TIMEX_DURATION_PATTERN.fullmatch(timex)
+    if match is None:
+        return 0
+    return sum(
+        int(count) * unit
+        for count, unit in zip(match.groups(), TIMEX_DURATION_UNITS)
+        if count is not None
+    )
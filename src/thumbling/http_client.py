@@ -0,0 +1,74 @@
+""" shared HTTP client for the outgoing requests of the bot
+
+The module creates the long-lived aiohttp client session which is used for the
+LUIS and Prometheus requests. The session is created once on app startup so
+connections, TLS sessions and DNS lookups are reused between the chat turns.
+"""
+
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+
+# used for every setting missing in the "http_client" custom service of the .bot file
+DEFAULT_CLIENT_CONFIG = {
+    "limit": 100,
+    "limitPerHost": 20,
+    "keepaliveTimeout": 30,
+    "dnsCacheTtl": 300,
+    "totalTimeout": 30,
+    "connectTimeout": 5,
+}
+
+
+def create_client_session(client_config: dict = None) -> aiohttp.ClientSession:
+    """ create a pooled client session from the http_client custom service config
+
+    Must be called with a running event loop, e.g. in an app on_startup hook.
+    """
+    config = {**DEFAULT_CLIENT_CONFIG, **(client_config or {})}
+    connector = aiohttp.TCPConnector(
+        limit=config["limit"],
+        limit_per_host=config["limitPerHost"],
+        keepalive_timeout=config["keepaliveTimeout"],
+        use_dns_cache=True,
+        ttl_dns_cache=config["dnsCacheTtl"],
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config["totalTimeout"], connect=config["connectTimeout"]
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_timeout(session: aiohttp.ClientSession, total: float) -> aiohttp.ClientTimeout:
+    """ the timeout of the session with at most the given total time
+
+    A request timeout replaces the session timeout, so the connect and read
+    timeouts of the session are kept and the total time is only shortened.
+    """
+    timeout = aiohttp.client.DEFAULT_TIMEOUT if session is None else session.timeout
+    if timeout.total is not None:
+        total = min(timeout.total, total)
+    return aiohttp.ClientTimeout(
+        total=total,
+        connect=timeout.connect,
+        sock_read=timeout.sock_read,
+        sock_connect=timeout.sock_connect,
+        ceil_threshold=timeout.ceil_threshold,
+    )
+
+
+@asynccontextmanager
+async def get(session: aiohttp.ClientSession, url: str, **kwargs):
+    """ send a GET request with the shared session
+
+    Without a shared session, e.g. outside of the bot app, a short-lived
+    session is used for the single request.
+    """
+    if session is not None:
+        async with session.get(url, **kwargs) as resp:
+            yield resp
+    else:
+        async with aiohttp.ClientSession() as short_lived_session:
+            async with short_lived_session.get(url, **kwargs) as resp:
+                yield resp
@@ -0,0 +1,141 @@
+""" run the bot app in several worker processes
+
+A single event loop uses only one core for the card building and the JSON
+decoding of the responses. The launcher starts a number of worker processes
+which each run the bot app on their own socket bound to the same port with
+SO_REUSEPORT, so the kernel distributes the connections between them. uvloop
+is used as event loop when it is installed.
+
+On SIGTERM or SIGINT the workers stop accepting connections, report that they
+are not ready any more, process their queued turns and wait for the running
+requests for at most the shutdown timeout. Workers which exit unexpectedly
+are restarted.
+
+To run the bot with 4 worker processes:
+
+    $ python -m thumbling.launcher --workers 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from aiohttp import web
+
+
+DEFAULT_PORT = 8000
+DEFAULT_SHUTDOWN_TIMEOUT = 30
+# seconds to wait before a crashed worker is restarted
+RESTART_DELAY = 1
+
+
+def use_uvloop() -> bool:
+    """ use uvloop for new event loops if it is installed
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    """ create a listening socket which shares its port with the other workers
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def run_worker(host: str, port: int, shutdown_timeout: float):
+    """ run the bot app in the current process until SIGTERM or SIGINT
+    """
+    from thumbling.bot_server import create_app
+
+    use_uvloop()
+    web.run_app(
+        create_app(),
+        sock=create_socket(host, port),
+        shutdown_timeout=shutdown_timeout,
+        print=None,
+    )
+
+
+def run_child_worker(host: str, port: int, shutdown_timeout: float):
+    """ run the bot app in a worker process started by the pool
+    """
+    # the pool forwards the signals, so a Ctrl+C in the terminal does not
+    # reach the workers twice
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    run_worker(host, port, shutdown_timeout)
+
+
+class WorkerPool:
+    """ keep a number of worker processes running until the pool is stopped
+    """
+
+    def __init__(self, num_workers: int, worker_args: tuple):
+        self.num_workers = num_workers
+        self.worker_args = worker_args
+        self.workers = []
+        self.stopping = False
+
+    def start_worker(self) -> multiprocessing.Process:
+        worker = multiprocessing.Process(target=run_child_worker, args=self.worker_args)
+        worker.start()
+        return worker
+
+    def stop(self, signum: int = signal.SIGTERM, frame=None):
+        self.stopping = True
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.workers = [self.start_worker() for _ in range(self.num_workers)]
+        while not self.stopping:
+            for index, worker in enumerate(self.workers):
+                if not worker.is_alive() and not self.stopping:
+                    time.sleep(RESTART_DELAY)
+                    self.workers[index] = self.start_worker()
+            time.sleep(0.5)
+        for worker in self.workers:
+            worker.join()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=DEFAULT_SHUTDOWN_TIMEOUT,
+        help="seconds to wait for running requests on shutdown",
+    )
+    args = parser.parse_args(argv)
+    worker_args = (args.host, args.port, args.shutdown_timeout)
+    if args.workers <= 1:
+        run_worker(*worker_args)
+    else:
+        WorkerPool(args.workers, worker_args).run()
+
+
+if __name__ == "__main__":
+    main()
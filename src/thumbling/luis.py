@@ -6,10 +6,30 @@ processing the results
 see https://eu.luis.ai/home and https://docs.microsoft.com/en-us/azure/cognitive-services/luis/
 """
 
+from datetime import datetime, timedelta
+import re
+import time
+
 import aiohttp
 
+from thumbling import http_client
+from thumbling.cache import Cache, TTLCache
+from thumbling.resilience import DeadlineExceededError, ResiliencePolicy
+from thumbling.singleflight import SingleFlight
+
 
 COGNATIVE_API_BASE_URL = "api.cognitive.microsoft.com/luis/v2.0/apps"
+# offset in minutes of the user's timezone to UTC to resolve relative datetimes
+TIMEZONE_OFFSET = 0
+
+DEFAULT_INTENT_CACHE_TTL = 3600
+# intents with datetimes relative to the current time of day get outdated fast
+TIME_SENSITIVE_CACHE_TTL = 60
+TIME_SENSITIVE_DATETIME_TYPES = {
+    "builtin.datetimeV2.datetime",
+    "builtin.datetimeV2.datetimerange",
+    "builtin.datetimeV2.duration",
+}
 
 
 class LuisError(Exception):
@@ -18,6 +38,63 @@ class LuisError(Exception):
     """
 
 
+class IntentCache:
+    """ cache the LUIS results of normalised sentences
+
+    Relative datetime entities like "today" are resolved by LUIS, so the date
+    at the timezone offset is part of the cache key and the results are
+    invalidated when the date changes. Results with datetimes relative to the
+    time of day are only cached shortly. The cache counts the LUIS latency
+    saved by its hits. The entries are stored in the given cache backend or in
+    memory.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = DEFAULT_INTENT_CACHE_TTL,
+        cache: Cache = None,
+    ):
+        self.cache = TTLCache(max_size) if cache is None else cache
+        self.ttl = ttl
+        self.saved_latency = 0.0
+
+    @staticmethod
+    def get_key(sentence: str, timezone_offset: int = TIMEZONE_OFFSET) -> tuple:
+        date = (datetime.utcnow() + timedelta(minutes=timezone_offset)).date()
+        return normalize_sentence(sentence), timezone_offset, date.isoformat()
+
+    def get(self, key: tuple) -> dict:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        message_intent, latency = entry
+        self.saved_latency += latency
+        return message_intent
+
+    def set(self, key: tuple, message_intent: dict, latency: float):
+        is_time_sensitive = any(
+            entity["type"] in TIME_SENSITIVE_DATETIME_TYPES
+            for entity in message_intent.get("entities", [])
+        )
+        ttl = min(self.ttl, TIME_SENSITIVE_CACHE_TTL) if is_time_sensitive else self.ttl
+        self.cache.set(key, (message_intent, latency), ttl)
+
+    def stats(self) -> dict:
+        requests = self.cache.hits + self.cache.misses
+        return {
+            **self.cache.stats(),
+            "hit_rate": self.cache.hits / requests if requests else 0.0,
+            "saved_latency": self.saved_latency,
+        }
+
+
+def normalize_sentence(sentence: str) -> str:
+    """ normalise case, whitespace and trailing punctuation of a sentence
+    """
+    return re.sub(r"\s+", " ", sentence).strip(" ?!.").casefold()
+
+
 def create_luis_url(config: dict) -> str:
     """ use the luis section of the bot services to create the service URL
     """
@@ -25,21 +102,70 @@ def create_luis_url(config: dict) -> str:
     return f"https://{region}.{COGNATIVE_API_BASE_URL}/{config['appId']}"
 
 
-async def get_message_intent(service_config: dict, sentence: str) -> dict:
+async def get_message_intent(
+    service_config: dict,
+    sentence: str,
+    session: aiohttp.ClientSession = None,
+    resilience: ResiliencePolicy = None,
+    deadline: float = None,
+    cache: IntentCache = None,
+    singleflight: SingleFlight = None,
+) -> dict:
+    """ get the intent and entities of a sentence
+
+    With a resilience policy failed requests are retried and not sent at all
+    while its circuit breaker is open. The requests have to finish before the
+    deadline, a time.monotonic() timestamp.
+    Results found in the optional cache are shared, so they must not be changed.
+    The same holds for the results of concurrent requests of the same normalised
+    sentence, which are sent only once with the optional singleflight.
+    """
     if len(sentence) > 500:
         raise LuisError(
             "the sentence is too long as it contains more than 500 characters"
         )
 
+    cache_key = IntentCache.get_key(sentence)
+    if cache is not None:
+        message_intent = cache.get(cache_key)
+        if message_intent is not None:
+            return message_intent
+
     headers = {"Ocp-Apim-Subscription-Key": service_config["subscriptionKey"]}
-    params = {"q": sentence, "timezoneOffset": "0"}
+    params = {"q": sentence, "timezoneOffset": str(TIMEZONE_OFFSET)}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            create_luis_url(service_config), headers=headers, params=params
+    async def request(request_deadline: float = None) -> dict:
+        request_kwargs = {}
+        if request_deadline is not None:
+            timeout = request_deadline - time.monotonic()
+            if timeout <= 0:
+                raise DeadlineExceededError("no time left for the LUIS request")
+            request_kwargs["timeout"] = http_client.get_timeout(session, timeout)
+        async with http_client.get(
+            session,
+            create_luis_url(service_config),
+            headers=headers,
+            params=params,
+            **request_kwargs,
         ) as resp:
+            if resp.status >= 500:
+                resp.raise_for_status()
             return await resp.json()
 
+    async def resilient_request() -> dict:
+        request_start = time.monotonic()
+        if resilience is None:
+            message_intent = await request(deadline)
+        else:
+            message_intent = await resilience.call(request, deadline)
+        if cache is not None and "topScoringIntent" in message_intent:
+            cache.set(cache_key, message_intent, time.monotonic() - request_start)
+        return message_intent
+
+    if singleflight is None:
+        return await resilient_request()
+    return await singleflight.do(cache_key, resilient_request)
+
 
 def group_datetimeV2_entities(entities: list) -> dict:
     groups = {
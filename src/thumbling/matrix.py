@@ -0,0 +1,236 @@
+""" incremental decoding and reduction of Prometheus matrix results
+
+Range query responses can be large as they contain every sample of every series.
+The module decodes the result series of a response body one after another while
+it is read, so each series can be reduced to the values the alert cards need
+before the next one is decoded. The memory used is bounded by the largest series
+instead of the whole response.
+Decoded series are stored as AlertSeries with compact columnar arrays, or are
+reduced to an AlertSummary.
+"""
+
+from array import array
+import codecs
+import json
+from operator import itemgetter
+import re
+from typing import AsyncIterator, Union
+
+import numpy
+
+
+Num = Union[int, float]
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+RESULT_START_PATTERN = re.compile(r'"result"\s*:\s*\[')
+SEPARATOR_PATTERN = re.compile(r"[\s,]*")
+
+
+class MatrixDecodeError(ValueError):
+    """
+    The response body is no valid Prometheus matrix result
+
+    It is a ValueError like the JSONDecodeError of a body which is decoded at
+    once, so it is no backend failure and is not retried.
+    """
+
+
+async def iter_matrix_series(
+    stream, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> AsyncIterator[dict]:
+    """ decode the series of a matrix response body one by one
+
+    The stream can be any object with an async read(n) method, e.g. the
+    content of an aiohttp response.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    eof = False
+
+    async def read(min_length: int) -> str:
+        nonlocal eof
+        text = ""
+        while not eof and len(text) < min_length:
+            chunk = await stream.read(chunk_size)
+            eof = not chunk
+            text += text_decoder.decode(chunk, final=eof)
+        return text
+
+    match = None
+    while match is None:
+        new_text = await read(chunk_size)
+        if not new_text and eof:
+            raise MatrixDecodeError("no result found in the response body")
+        buffer += new_text
+        match = RESULT_START_PATTERN.search(buffer)
+    buffer = buffer[match.end() :]
+
+    while True:
+        position = SEPARATOR_PATTERN.match(buffer).end()
+        if position == len(buffer):
+            if eof:
+                raise MatrixDecodeError("the result list is not closed")
+            buffer += await read(chunk_size)
+            continue
+        if buffer[position] == "]":
+            # read the rest so the connection can be reused
+            while not eof:
+                await read(chunk_size)
+            return
+        try:
+            series, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise MatrixDecodeError("the response body is not valid JSON")
+            # read at least as much as already buffered to decode long series
+            # in amortized linear time
+            buffer += await read(max(len(buffer), chunk_size))
+            continue
+        buffer = buffer[end:]
+        yield series
+
+
+class AlertSeries:
+    """ a series of a matrix result with its samples in compact columnar arrays
+
+    The labels are a sorted tuple of (name, value) pairs, the timestamps and the
+    sample values are stored as arrays of doubles.
+    """
+
+    __slots__ = ("labels", "timestamps", "values")
+
+    def __init__(self, labels: tuple, timestamps: array, values: array):
+        self.labels = labels
+        self.timestamps = timestamps
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, series: dict) -> "AlertSeries":
+        """ create the columnar series from a series of a matrix result
+        """
+        samples = series["values"]
+        return cls(
+            tuple(sorted(series["metric"].items())),
+            array("d", map(itemgetter(0), samples)),
+            array("d", map(float, map(itemgetter(1), samples))),
+        )
+
+    @property
+    def metric(self) -> dict:
+        return dict(self.labels)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __repr__(self) -> str:
+        return f"AlertSeries({self.metric}, {len(self)} samples)"
+
+    def get_episodes(self, step: Num = 60) -> list:
+        """ get the (start, end) timestamps of the episodes the alert was firing
+
+        Samples which are more than one step apart belong to different episodes.
+        """
+        return find_episodes(self.timestamps, step)
+
+    def summarize(self, step: Num = 60) -> "AlertSummary":
+        """ reduce the series to the values the alert cards need
+        """
+        if not self.timestamps:
+            return AlertSummary(self.labels, None, None, 0, [])
+        episodes = self.get_episodes(step)
+        return AlertSummary(
+            self.labels,
+            episodes[0][0],
+            episodes[-1][1],
+            len(self.timestamps),
+            episodes,
+        )
+
+
+class AlertSummary:
+    """ the time span, sample count and firing episodes of an alert series
+    """
+
+    __slots__ = ("labels", "first", "last", "count", "episodes")
+
+    def __init__(
+        self, labels: tuple, first: Num, last: Num, count: int, episodes: list
+    ):
+        self.labels = labels
+        self.first = first
+        self.last = last
+        self.count = count
+        self.episodes = episodes
+
+    @property
+    def metric(self) -> dict:
+        return dict(self.labels)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, AlertSummary):
+            return NotImplemented
+        return all(
+            getattr(self, attribute) == getattr(other, attribute)
+            for attribute in self.__slots__
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __repr__(self) -> str:
+        return f"AlertSummary({self.metric}, {self.first} - {self.last})"
+
+    def summarize(self, step: Num = 60) -> "AlertSummary":
+        return self
+
+
+def find_episodes(timestamps: array, step: Num = 60) -> list:
+    """ segment sorted timestamps into (start, end) episodes
+
+    A gap of more than one step between two timestamps starts a new episode.
+    The gaps are found with vectorised differences on a view of the array.
+    """
+    if not timestamps:
+        return []
+    timestamps = numpy.frombuffer(timestamps, dtype=numpy.float64)
+    gaps = numpy.flatnonzero(numpy.diff(timestamps) > step) + 1
+    starts = numpy.concatenate(([0], gaps))
+    ends = numpy.concatenate((gaps - 1, [len(timestamps) - 1]))
+    return list(zip(timestamps[starts].tolist(), timestamps[ends].tolist()))
+
+
+def summarize_series(series: dict, step: Num = 60) -> AlertSummary:
+    """ reduce a series of a matrix result to the values the alert cards need
+    """
+    return AlertSeries.from_dict(series).summarize(step)
+
+
+def stitch_series(parts: list, step: Num = 60):
+    """ stitch the parts of one series from consecutive time ranges together
+
+    The parts are either all AlertSeries or all AlertSummary in time order.
+    Episodes of summaries which continue over a border of the time ranges
+    are merged.
+    """
+    if isinstance(parts[0], AlertSeries):
+        timestamps, values = array("d"), array("d")
+        for part in parts:
+            timestamps.extend(part.timestamps)
+            values.extend(part.values)
+        return AlertSeries(parts[0].labels, timestamps, values)
+
+    episodes = []
+    for part in parts:
+        for episode in part.episodes:
+            if episodes and episode[0] - episodes[-1][1] <= step:
+                episodes[-1] = (episodes[-1][0], episode[1])
+            else:
+                episodes.append(episode)
+    return AlertSummary(
+        parts[0].labels,
+        episodes[0][0] if episodes else None,
+        episodes[-1][1] if episodes else None,
+        sum(part.count for part in parts),
+        episodes,
+    )
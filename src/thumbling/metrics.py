@@ -0,0 +1,273 @@
+""" metrics of the bot in the Prometheus text format
+
+The bot records the latencies of its stages, e.g. the LUIS request, the
+Prometheus queries, the card building and the sends to the Bot Connector, and
+counts intents, errors and turns. The metrics are kept in plain Python objects
+without locks, as they are only changed in the event loop, so recording a value
+costs about a microsecond. Values like the cache statistics, which exist
+already, are read only when the metrics are scraped.
+"""
+
+from bisect import bisect_left
+import time
+from typing import Iterator
+
+
+# seconds, from a cached LUIS result to a slow Prometheus query
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    labels = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ a metric with a value per combination of label values
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        for label_values, value in sorted(self.values.items()):
+            labels = format_labels(self.label_names, label_values)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Counter(Metric):
+    """ a count which only increases
+    """
+
+    metric_type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """ a value which can go up and down
+    """
+
+    metric_type = "gauge"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+
+class Timer:
+    """ observe the time from entering to leaving the context in a histogram
+    """
+
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: "Histogram", label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Histogram(Metric):
+    """ counts of observed values in buckets with upper bounds
+
+    The counts are kept per bucket and only accumulated when they are
+    collected, so an observation is one bisection and two additions.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * len(self.buckets), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *label_values) -> Timer:
+        return Timer(self, label_values)
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        for label_values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names, label_values, f'le="{format_value(bound)}"'
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class BotMetrics:
+    """ the metrics of the bot app in one process
+
+    The caches are passed in to report their sizes, hits, misses and further
+    statistics like the saved latency of the intent cache, and the
+    singleflights to report the started and collapsed requests by backend.
+    """
+
+    def __init__(self, caches: dict = None, singleflights: dict = None):
+        self.caches = caches or {}
+        self.singleflights = singleflights or {}
+        self.stage_duration = Histogram(
+            "thumbling_stage_duration_seconds",
+            "Duration of the stages of a turn.",
+            ("stage",),
+        )
+        self.turn_duration = Histogram(
+            "thumbling_turn_duration_seconds", "Duration of the turns."
+        )
+        self.turns_in_flight = Gauge(
+            "thumbling_turns_in_flight", "Number of turns which are processed."
+        )
+        self.intents = Counter(
+            "thumbling_intents_total",
+            "Number of recognised intents.",
+            ("intent", "recognizer"),
+        )
+        self.rejected_turns = Counter(
+            "thumbling_rejected_turns_total",
+            "Number of messages over the rate limits by limit.",
+            ("limit",),
+        )
+        self.errors = Counter(
+            "thumbling_errors_total", "Number of errors by stage.", ("stage",)
+        )
+
+    def collect_caches(self) -> list:
+        metrics = [
+            Gauge("thumbling_cache_entries", "Number of cache entries.", ("cache",)),
+            Counter("thumbling_cache_hits_total", "Number of cache hits.", ("cache",)),
+            Counter(
+                "thumbling_cache_misses_total", "Number of cache misses.", ("cache",)
+            ),
+        ]
+        hit_ratio = Gauge(
+            "thumbling_cache_hit_ratio", "Ratio of the cache hits.", ("cache",)
+        )
+        # statistics only some caches have
+        optional_metrics = {
+            "saved_latency": Counter(
+                "thumbling_cache_saved_seconds_total",
+                "Backend request time saved by cache hits.",
+                ("cache",),
+            ),
+            "busy": Counter(
+                "thumbling_cache_busy_total",
+                "Number of cache reads and writes given up as the cache was busy.",
+                ("cache",),
+            ),
+        }
+        for name, cache in self.caches.items():
+            if cache is None:
+                continue
+            stats = cache.stats()
+            for metric, key in zip(metrics, ["size", "hits", "misses"]):
+                metric.values[(name,)] = stats[key]
+            requests = stats["hits"] + stats["misses"]
+            hit_ratio.values[(name,)] = stats["hits"] / requests if requests else 0.0
+            for key, metric in optional_metrics.items():
+                if key in stats:
+                    metric.values[(name,)] = stats[key]
+        return [*metrics, hit_ratio, *optional_metrics.values()]
+
+    def collect_singleflights(self) -> list:
+        metrics = [
+            Gauge(
+                "thumbling_requests_in_flight",
+                "Number of running backend requests.",
+                ("backend",),
+            ),
+            Counter(
+                "thumbling_requests_started_total",
+                "Number of sent backend requests.",
+                ("backend",),
+            ),
+            Counter(
+                "thumbling_requests_collapsed_total",
+                "Number of backend requests which joined an identical running one.",
+                ("backend",),
+            ),
+        ]
+        for name, singleflight in self.singleflights.items():
+            stats = singleflight.stats()
+            for metric, key in zip(metrics, ["in_flight", "started", "collapsed"]):
+                metric.values[(name,)] = stats[key]
+        return metrics
+
+    def render(self) -> str:
+        metrics = [
+            self.stage_duration,
+            self.turn_duration,
+            self.turns_in_flight,
+            self.intents,
+            self.rejected_turns,
+            self.errors,
+            *self.collect_caches(),
+            *self.collect_singleflights(),
+        ]
+        return "\n".join(line for metric in metrics for line in metric.collect()) + "\n"
@@ -0,0 +1,107 @@
+""" speculative Prometheus queries while the intent of a message is unknown
+
+LUIS and Prometheus latencies add up if the alerts are only queried after LUIS
+has answered. The module starts the alert queries for the services and
+instances found by a cheap local scan of the message right away, for the
+default time range of today. If LUIS confirms a problem intent with the same
+alerts and time range, the running queries are used for the reply, otherwise
+they are cancelled.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from thumbling.luis import TIMEZONE_OFFSET
+from thumbling.prometheus import (
+    MAX_SELECTOR_LENGTH,
+    get_alert_selectors,
+    get_coalesced_alert_queries,
+    get_query_time_ranges,
+)
+
+
+# seconds the end of a time range may have moved on until the intent is known
+PREFETCH_END_TOLERANCE = 60
+
+
+class SpeculativePrefetch:
+    """ the running speculative queries of one message
+    """
+
+    def __init__(
+        self, prometheus_api, coalesced_queries: list, time_range: tuple, deadline
+    ):
+        self.time_range = time_range
+        start, end = time_range
+        step = prometheus_api.get_query_step(start, end)
+        self.tasks = {
+            query_string: asyncio.ensure_future(
+                prometheus_api.query_range(
+                    query_string, start=start, end=end, step=step, deadline=deadline
+                )
+            )
+            for query_string, _ in coalesced_queries
+        }
+
+    def take(self, query_string: str, time_range: tuple) -> asyncio.Future:
+        """ get the running query for the same query and time range or None
+
+        Only the end of the time range may differ a bit, as it moves on with the
+        current time while LUIS is requested.
+        """
+        if (
+            time_range[0] != self.time_range[0]
+            or abs(time_range[1] - self.time_range[1]) > PREFETCH_END_TOLERANCE
+        ):
+            return None
+        return self.tasks.pop(query_string, None)
+
+    def cancel(self):
+        """ cancel the queries which were not taken
+        """
+        for task in self.tasks.values():
+            if task.done():
+                if not task.cancelled():
+                    # retrieve the exception so it is not logged as unhandled
+                    task.exception()
+            else:
+                task.cancel()
+        self.tasks.clear()
+
+
+def get_today_time_range(timezone_offset: int = TIMEZONE_OFFSET) -> tuple:
+    """ get the time range of today like it is resolved from a LUIS date entity
+    """
+    date = (datetime.utcnow() + timedelta(minutes=timezone_offset)).strftime(
+        "%Y-%m-%d"
+    )
+    time_ranges = get_query_time_ranges(
+        [
+            {
+                "type": "builtin.datetimeV2.date",
+                "resolution": {
+                    "values": [{"timex": date, "type": "date", "value": date}]
+                },
+            }
+        ]
+    )
+    return time_ranges[0] if time_ranges else None
+
+
+def start_speculative_prefetch(
+    prometheus_api, prometheus_config: dict, entities: list, deadline: float
+) -> SpeculativePrefetch:
+    """ start the alert queries of today for the service and instance entities
+
+    Returns None if there is nothing to query.
+    """
+    label, values = get_alert_selectors(entities)
+    time_range = get_today_time_range()
+    if not values or time_range is None:
+        return None
+    coalesced_queries = get_coalesced_alert_queries(
+        label,
+        values,
+        prometheus_config.get("maxSelectorLength", MAX_SELECTOR_LENGTH),
+    )
+    return SpeculativePrefetch(prometheus_api, coalesced_queries, time_range, deadline)
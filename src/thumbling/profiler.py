@@ -0,0 +1,67 @@
+""" a sampling profiler for the thread of the running event loop
+
+A background thread takes the stack of the event loop thread at a fixed
+interval and counts how often each stack was seen. The stacks are returned in
+the collapsed format of the flame graph tools, one line per stack with its
+frames from the outermost to the innermost separated by semicolons and the
+number of samples. Samples of an idle event loop end in the selector.
+Sampling needs no changes of the profiled code and adds only little overhead
+to the event loop, so it can be used in production.
+"""
+
+from collections import Counter
+import os
+import sys
+import threading
+
+
+DEFAULT_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """ sample the stacks of one thread until the profiler is stopped
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = DEFAULT_INTERVAL):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="thumbling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[get_stack(frame)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """ the sampled stacks in the collapsed format, the most frequent first
+        """
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+def get_stack(frame) -> tuple:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        file_name = os.path.basename(code.co_filename)
+        stack.append(f"{code.co_name} ({file_name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return tuple(reversed(stack))
@@ -5,33 +5,152 @@ helpers to create correct query parameters.
 """
 
 
-from datetime import datetime, timedelta
+import asyncio
+from collections import deque
+import re
 import time
 from typing import Union
 
 import aiohttp
 
-from thumbling.luis import group_datetimeV2_entities
+from thumbling import http_client
+from thumbling.cache import Cache
+from thumbling.datetime_resolver import resolve_time_ranges
+from thumbling.matrix import AlertSeries, iter_matrix_series, summarize_series
+from thumbling.resilience import DeadlineExceededError, ResiliencePolicy
+from thumbling.singleflight import SingleFlight
+from thumbling import tracing
 from thumbling.utils import str2timestamp
 
 
 Num = Union[int, float]
 
+QUERY_PATH = "/api/v1/query"
+QUERY_RANGE_PATH = "/api/v1/query_range"
+# seconds to wait for an endpoint before hedging while its latencies are unknown
+DEFAULT_HEDGE_DELAY = 1.0
+
+# maximal length of the label value regex of a coalesced query
+MAX_SELECTOR_LENGTH = 1000
+
+# query results of time ranges ending in this window before now can still change
+RECENT_WINDOW = 300
+DEFAULT_CACHE_TTL = 30
+
+# possible steps of range queries, the smallest one within the points budget is used
+QUERY_STEPS = [
+    "1m",
+    "2m",
+    "5m",
+    "10m",
+    "15m",
+    "30m",
+    "1h",
+    "2h",
+    "3h",
+    "6h",
+    "12h",
+    "1d",
+]
+DEFAULT_MAX_POINTS = 1500
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_PATTERN = re.compile(r"(\d+)(ms|s|m|h|d|w)")
+
+
+class LatencyTracker:
+    """ keep the latencies of the latest requests to derive hedging delays
+    """
+
+    def __init__(self, window_size: int = 100, min_samples: int = 20):
+        self.latencies = deque(maxlen=window_size)
+        self.min_samples = min_samples
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+
+    def get_percentile(self, percentile: float, default: float) -> float:
+        """ get the latency percentile or the default with too few latencies
+        """
+        if len(self.latencies) < self.min_samples:
+            return default
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
 
 class PrometheusAPI:
     """ Query a Prometheus server API
 
+    Range query results are stored in the optional cache, which is shared
+    between the instances. Results of time ranges in the past never expire,
+    results of recent time ranges expire after the cacheTtl of the service config.
+    Without an explicit step the step of range queries adapts to the range width,
+    so there are at most maxPointsPerSeries points per series.
+    The series of range query results are converted to columnar AlertSeries.
+    With streamResponses enabled range query results are decoded while they are
+    read and each series is reduced to its AlertSummary instead.
+
+    With several endpoints, e.g. of a HA Prometheus pair, the replicaMode of the
+    service config defines how they are used. With "hedge" a request is sent to
+    the next endpoint if the previous one did not answer within the
+    hedgePercentile of the latest latencies, the first successful answer is used.
+    With "merge" range queries are sent to all endpoints and the series of the
+    results are deduplicated, ignoring the replicaLabels.
+
+    With a resilience policy failed requests are retried and not sent at all
+    while the circuit breaker of the policy is open.
+
+    Concurrent identical range queries of all instances which share the
+    optional singleflight are sent only once. The optional query limiter
+    bounds the concurrent range queries of all instances which share it.
+
     see https://prometheus.io/docs/prometheus/latest/querying/api/
     """
 
-    def __init__(self, service_config: dict):
-        if service_config["endpoint"].endswith("/"):
-            self.base_url = service_config["endpoint"][:-1]
-        else:
-            self.base_url = service_config["endpoint"]
+    def __init__(
+        self,
+        service_config: dict,
+        session: aiohttp.ClientSession = None,
+        cache: Cache = None,
+        latency_tracker: LatencyTracker = None,
+        resilience: ResiliencePolicy = None,
+        singleflight: SingleFlight = None,
+        query_limiter: asyncio.Semaphore = None,
+    ):
+        endpoints = service_config.get("endpoints") or [service_config["endpoint"]]
+        self.base_urls = [
+            endpoint[:-1] if endpoint.endswith("/") else endpoint
+            for endpoint in endpoints
+        ]
+        self.base_url = self.base_urls[0]
+        self.query_url = self.base_url + QUERY_PATH
+        self.query_range_url = self.base_url + QUERY_RANGE_PATH
+        self.session = session
+        self.cache = cache
+        self.cache_ttl = service_config.get("cacheTtl", DEFAULT_CACHE_TTL)
+        self.max_points = service_config.get("maxPointsPerSeries", DEFAULT_MAX_POINTS)
+        self.stream_responses = service_config.get("streamResponses", False)
+        self.replica_mode = service_config.get("replicaMode", "hedge")
+        self.replica_labels = set(service_config.get("replicaLabels", []))
+        self.hedge_percentile = service_config.get("hedgePercentile", 0.95)
+        self.hedge_delay = service_config.get("hedgeDelay", DEFAULT_HEDGE_DELAY)
+        self.latency_tracker = latency_tracker or LatencyTracker()
+        self.resilience = resilience
+        self.singleflight = singleflight
+        self.query_limiter = query_limiter
+
+    def get_query_step(self, start: Num, end: Num) -> str:
+        """ get the step of a range query within the points per series budget
+        """
+        return get_query_step(start, end, self.max_points)
 
-        self.query_url = self.base_url + "/api/v1/query"
-        self.query_range_url = self.base_url + "/api/v1/query_range"
+    def get_request_timeout(self, request_deadline: float) -> float:
+        """ get the time left until the deadline of a request
+        """
+        request_timeout = round(request_deadline - time.monotonic(), 3)
+        if request_timeout <= 0:
+            raise DeadlineExceededError("no time left for the query")
+        return request_timeout
 
     async def query(
         self, query_string: str, time: str = None, timeout: int = None
@@ -41,26 +160,246 @@ class PrometheusAPI:
             params["time"] = str2timestamp(time)
         if timeout is not None:
             params["timeout"] = timeout
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.query_url, params=params) as resp:
-                return await resp.json()
+
+        async def request(request_deadline: float = None) -> dict:
+            request_kwargs = {}
+            if request_deadline is not None:
+                request_kwargs["timeout"] = http_client.get_timeout(
+                    self.session, self.get_request_timeout(request_deadline)
+                )
+            return await self._hedged_request(QUERY_PATH, params, request_kwargs)
+
+        if self.resilience is None:
+            return await request()
+        return await self.resilience.call(request)
 
     async def query_range(
         self,
         query_string: str,
         start: str,
         end: str,
-        step: str = "1m",
+        step: str = None,
         timeout: int = None,
+        deadline: float = None,
     ) -> dict:
-        params = {"query": query_string, "step": step}
-        if timeout is not None:
-            params["timeout"] = timeout
-        params["start"] = start
-        params["end"] = end
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.query_range_url, params=params) as resp:
-                return await resp.json()
+        """ query a time range
+
+        The deadline is a time.monotonic() timestamp, the remaining time until
+        it, at most the requestTimeout of the resilience policy, is used as query
+        timeout if no explicit timeout is given.
+        """
+        start = str2timestamp(start)
+        end = str2timestamp(end)
+        if step is None:
+            step = self.get_query_step(start, end)
+        # aligned to the step the evaluation timestamps and cache keys are stable
+        step_seconds = duration2seconds(step)
+        start = align_timestamp(start, step_seconds)
+        end = align_timestamp(end, step_seconds)
+        cache_key = (query_string, step, start, end, self.stream_responses)
+        if self.cache is not None:
+            result = self.cache.get(cache_key)
+            if result is not None:
+                return result
+
+        async def request(request_deadline: float = None) -> dict:
+            params = {"query": query_string, "step": step}
+            request_kwargs = {}
+            request_timeout = timeout
+            if request_timeout is None and request_deadline is not None:
+                request_timeout = self.get_request_timeout(request_deadline)
+                request_kwargs["timeout"] = http_client.get_timeout(
+                    self.session, request_timeout
+                )
+            if request_timeout is not None:
+                params["timeout"] = request_timeout
+            params["start"] = start
+            params["end"] = end
+            if self.replica_mode == "merge" and len(self.base_urls) > 1:
+                return await self._merged_request(
+                    QUERY_RANGE_PATH, params, request_kwargs, step_seconds
+                )
+            return await self._hedged_request(
+                QUERY_RANGE_PATH, params, request_kwargs, step_seconds
+            )
+
+        async def limited_request(request_deadline: float = None) -> dict:
+            if self.query_limiter is None:
+                return await request(request_deadline)
+            async with self.query_limiter:
+                return await request(request_deadline)
+
+        async def resilient_request() -> dict:
+            if self.resilience is None:
+                result = await limited_request(deadline)
+            else:
+                result = await self.resilience.call(limited_request, deadline)
+            if self.cache is not None and result.get("status") == "success":
+                is_recent = end >= time.time() - RECENT_WINDOW
+                self.cache.set(cache_key, result, self.cache_ttl if is_recent else None)
+            return result
+
+        if self.singleflight is None:
+            return await resilient_request()
+        return await self.singleflight.do(cache_key, resilient_request)
+
+    async def _request(
+        self,
+        base_url: str,
+        path: str,
+        params: dict,
+        request_kwargs: dict,
+        step_seconds: Num = None,
+    ) -> dict:
+        """ send a request to one endpoint and decode its matrix result
+        """
+        request_start = time.monotonic()
+        with tracing.span("prometheus_request", endpoint=base_url):
+            async with http_client.get(
+                self.session, base_url + path, params=params, **request_kwargs
+            ) as resp:
+                if resp.status >= 500:
+                    resp.raise_for_status()
+                if self.stream_responses and step_seconds and resp.status == 200:
+                    series_summaries = [
+                        summarize_series(series, step_seconds)
+                        async for series in iter_matrix_series(resp.content)
+                    ]
+                    result = {
+                        "status": "success",
+                        "data": {"resultType": "matrix", "result": series_summaries},
+                    }
+                else:
+                    result = await resp.json()
+                    if (
+                        result.get("status") == "success"
+                        and result["data"]["resultType"] == "matrix"
+                    ):
+                        result["data"]["result"] = [
+                            AlertSeries.from_dict(series)
+                            for series in result["data"]["result"]
+                        ]
+        if result.get("status") == "success":
+            self.latency_tracker.record(time.monotonic() - request_start)
+        return result
+
+    async def _hedged_request(
+        self, path: str, params: dict, request_kwargs: dict, step_seconds: Num = None
+    ) -> dict:
+        """ send the request to the endpoints one after another until one succeeds
+
+        The next endpoint is requested as soon as the previous one failed or did
+        not answer within the hedging delay. Earlier requests are not cancelled
+        by that, the first successful answer of any endpoint is returned.
+        If all endpoints fail the result or error of the first one is returned.
+        """
+        pending = set()
+        failed = []
+        try:
+            for index, base_url in enumerate(self.base_urls):
+                request = self._request(
+                    base_url, path, params, request_kwargs, step_seconds
+                )
+                pending.add(asyncio.ensure_future(request))
+                is_last = index == len(self.base_urls) - 1
+                hedge_delay = self.latency_tracker.get_percentile(
+                    self.hedge_percentile, self.hedge_delay
+                )
+                hedge_time = time.monotonic() + hedge_delay
+                while pending:
+                    timeout = None if is_last else max(0, hedge_time - time.monotonic())
+                    done, pending = await asyncio.wait(
+                        pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        break
+                    for task in done:
+                        if is_successful(task):
+                            return task.result()
+                        failed.append(task)
+            return failed[0].result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _merged_request(
+        self, path: str, params: dict, request_kwargs: dict, step_seconds: Num
+    ) -> dict:
+        """ send the request to all endpoints and merge the successful results
+        """
+        results = await asyncio.gather(
+            *(
+                self._request(base_url, path, params, request_kwargs, step_seconds)
+                for base_url in self.base_urls
+            ),
+            return_exceptions=True,
+        )
+        successful_results = [
+            result
+            for result in results
+            if isinstance(result, dict) and result.get("status") == "success"
+        ]
+        if not successful_results:
+            if isinstance(results[0], Exception):
+                raise results[0]
+            return results[0]
+        return merge_replica_results(successful_results, self.replica_labels)
+
+
+def is_successful(task: asyncio.Future) -> bool:
+    """ check if a finished request task returned a successful result
+    """
+    return task.exception() is None and task.result().get("status") == "success"
+
+
+def merge_replica_results(results: list, replica_labels: set = frozenset()) -> dict:
+    """ merge the matrix results of replicas and deduplicate their series
+
+    Series are identical if their labels without the replica labels are equal,
+    of identical series the one with the most samples is kept.
+    """
+    merged_series = {}
+    for result in results:
+        for series in result["data"]["result"]:
+            if replica_labels:
+                series.labels = tuple(
+                    label for label in series.labels if label[0] not in replica_labels
+                )
+            known_series = merged_series.get(series.labels)
+            if known_series is None or len(series) > len(known_series):
+                merged_series[series.labels] = series
+    return {
+        "status": "success",
+        "data": {"resultType": "matrix", "result": list(merged_series.values())},
+    }
+
+
+def get_query_step(start: Num, end: Num, max_points: int = DEFAULT_MAX_POINTS) -> str:
+    """ get the smallest query step for at most max_points points per series
+    """
+    for step in QUERY_STEPS:
+        if (end - start) / duration2seconds(step) + 1 <= max_points:
+            return step
+    return QUERY_STEPS[-1]
+
+
+def duration2seconds(duration: str) -> Num:
+    """ convert a Prometheus duration like "1m" or "1h30m" to seconds
+    """
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(duration)
+    if not parts or "".join(value + unit for value, unit in parts) != duration:
+        raise ValueError(f"invalid Prometheus duration {duration}")
+    return sum(int(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+
+def align_timestamp(timestamp: Num, step: Num) -> int:
+    """ align a timestamp to the previous multiple of the step
+    """
+    return int(timestamp - timestamp % step) if step >= 1 else int(timestamp)
 
 
 def get_limited_time_range(start: Num, end: Num, safety: int = 30) -> (int, int):
@@ -77,88 +416,102 @@ def get_limited_time_range(start: Num, end: Num, safety: int = 30) -> (int, int)
     return int(start), int(end)
 
 
-def get_query_time_ranges(entities: list) -> list:
+def get_query_time_ranges(entities: list, now: Num = None) -> list:
     """ transform intent entities datetimeV2 to timestap tuples
 
-    A very incomplete and faulty implementation of datetimeV2 entities
-    to Prometheus valid timestamp tuples for the start/end query parameters.
-    There must be better solutions.
+    All entities are resolved in one pass against the same now timestamp, by
+    default the current time, and the overlapping time ranges are merged.
     """
-    time_entities = group_datetimeV2_entities(entities)
-    time_ranges = []
-    for subtype in time_entities:
-        if subtype == "time":
-            for entity in time_entities[subtype]:
-                for value in entity:
-                    # use a 10 minutes time window
-                    time_value = datetime.combine(
-                        datetime.today(),
-                        datetime.strptime(value["value"], "%H:%M:%S").time(),
-                    ).timestamp()
-                    time_range = get_limited_time_range(
-                        time_value - 300, time_value + 300
-                    )
-                    if time_range is not None:
-                        time_ranges.append(time_range)
-        elif subtype == "date":
-            for entity in time_entities[subtype]:
-                for value in entity:
-                    start_time = datetime.strptime(value["value"], "%Y-%m-%d")
-                    end_time = start_time + timedelta(days=1)
-                    time_range = get_limited_time_range(
-                        start_time.timestamp(), end_time.timestamp()
-                    )
-                    if time_range is not None:
-                        time_ranges.append(time_range)
-        elif subtype in ["daterange", "datetimerange"]:
-            for entity in time_entities[subtype]:
-                for value in entity:
-                    if "end" not in value:
-                        value["end"] = int(time.time())
-                    start_time = str2timestamp(value["start"])
-                    end_time = str2timestamp(value["end"])
-                    time_range = get_limited_time_range(start_time, end_time)
-                    if time_range is not None:
-                        time_ranges.append(time_range)
-        elif subtype in "timerange":
-            for entity in time_entities[subtype]:
-                for value in entity:
-                    if "end" not in value:
-                        end_time = int(time.time())
-                    else:
-                        end_time = datetime.combine(
-                            datetime.today(),
-                            datetime.strptime(value["end"], "%H:%M:%S").time(),
-                        ).timestamp()
-                    start_time = datetime.combine(
-                        datetime.today(),
-                        datetime.strptime(value["start"], "%H:%M:%S").time(),
-                    ).timestamp()
-                    time_range = get_limited_time_range(start_time, end_time)
-                    if time_range is not None:
-                        time_ranges.append(time_range)
-    return time_ranges
+    return merge_time_ranges(resolve_time_ranges(entities, now))
 
 
-def get_alert_queries(entities: list) -> list:
-    """ create the value for the Prometheus query parameter based on the entities
+def merge_time_ranges(time_ranges: list, max_gap: Num = 0) -> list:
+    """ merge overlapping and adjacent time ranges to the minimal set of ranges
 
-    This is also very rudimentary and must probably adapted to each ones use case.
+    Ranges which are at most max_gap seconds apart are merged as well.
+    The returned ranges are sorted by their start.
+    """
+    merged_ranges = []
+    for start, end in sorted(time_ranges):
+        if merged_ranges and start - merged_ranges[-1][1] <= max_gap:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], end))
+        else:
+            merged_ranges.append((start, end))
+    return merged_ranges
+
+
+def get_alert_selectors(entities: list) -> (str, list):
+    """ get the label name and the label values to select the alerts by
+
+    Instances are the more specific search targets so they are preferred
+    over service names. Without any of both the label name is None.
     """
     instance_entities = [e for e in entities if e["type"] == "instance"]
     if instance_entities:
-        queries = []
-        for entity in instance_entities:
-            instance = entity["entity"].replace(" ", "")
-            queries.append(f'ALERTS{{instance="{instance}"}}')
-        return queries
+        return "instance", [e["entity"].replace(" ", "") for e in instance_entities]
 
     # if we do not have specific search targets we use the less specific ones
     service_name_entities = [e for e in entities if e["type"] == "service-name"]
     if service_name_entities:
-        queries = []
-        for entity in service_name_entities:
-            queries.append(f'ALERTS{{service="{entity["entity"]}"}}')
-        return queries
+        return "service", [e["entity"] for e in service_name_entities]
+
+    return None, []
+
+
+def get_alert_queries(entities: list) -> list:
+    """ create the value for the Prometheus query parameter based on the entities
+
+    This is also very rudimentary and must probably adapted to each ones use case.
+    """
+    label, values = get_alert_selectors(entities)
+    return [f'ALERTS{{{label}="{escape_label_value(value)}"}}' for value in values]
+
 
-    return []
+def escape_label_value(value: str) -> str:
+    """ escape a value to be used inside a double quoted PromQL string
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def get_coalesced_alert_queries(
+    label: str, values: list, max_selector_length: int = MAX_SELECTOR_LENGTH
+) -> list:
+    """ combine the alert queries for several label values into regex queries
+
+    Each returned entry is a tuple of the query and the label values it selects.
+    The values are escaped for an exact regex match and the values of one query
+    are limited by max_selector_length, so very long entity lists result in
+    more than one query. A single value is selected by an equality matcher.
+    """
+    groups = []
+    group, group_length = [], 0
+    for value in dict.fromkeys(values):
+        value_length = len(escape_label_value(re.escape(value)))
+        if group and group_length + 1 + value_length > max_selector_length:
+            groups.append(group)
+            group, group_length = [], 0
+        group_length += value_length + (1 if group else 0)
+        group.append(value)
+    if group:
+        groups.append(group)
+
+    queries = []
+    for group in groups:
+        if len(group) == 1:
+            selector = f'{label}="{escape_label_value(group[0])}"'
+        else:
+            regex = "|".join(re.escape(value) for value in group)
+            selector = f'{label}=~"{escape_label_value(regex)}"'
+        queries.append((f"ALERTS{{{selector}}}", group))
+    return queries
+
+
+def split_result_by_label(result: list, label: str, values: list) -> dict:
+    """ demultiplex the series of a coalesced query result by a label value
+    """
+    results = {value: [] for value in values}
+    for series in result:
+        value = series.metric.get(label)
+        if value in results:
+            results[value].append(series)
+    return results
@@ -0,0 +1,129 @@
+""" split long Prometheus range queries into day aligned shards
+
+Similar to the query frontends of Thanos and Cortex, a long range query is split
+into shards at the borders of UTC days. The shards are queried concurrently and
+their results are stitched together to the result of the whole range.
+As the shard borders do not depend on the queried range, the results of past
+shards are cached by the PrometheusAPI and reused by later questions.
+"""
+
+import asyncio
+
+from thumbling.matrix import stitch_series
+from thumbling.prometheus import (
+    PrometheusAPI,
+    Num,
+    align_timestamp,
+    duration2seconds,
+)
+from thumbling.utils import str2timestamp
+
+
+DEFAULT_SHARD_SIZE = 86400
+DEFAULT_MAX_CONCURRENT_SHARDS = 4
+
+
+def get_shard_ranges(start: int, end: int, step: Num, shard_size: int) -> list:
+    """ split a step aligned time range into shards at multiples of the shard size
+
+    Each evaluation timestamp start + n * step is part of exactly one shard.
+    """
+    shard_ranges = []
+    shard_start = start
+    while shard_start <= end:
+        next_border = (shard_start // shard_size + 1) * shard_size
+        # the first evaluation timestamp at or after the border starts the next shard
+        next_start = shard_start + -(-(next_border - shard_start) // step) * step
+        shard_ranges.append((shard_start, int(min(end, next_start - step))))
+        shard_start = int(next_start)
+    return shard_ranges
+
+
+class QueryFrontend:
+    """ query long time ranges of a PrometheusAPI in shards
+
+    It provides the range query interface of the PrometheusAPI. The step is
+    chosen for the whole range, so the shards keep the points per series budget.
+    The shardSize and maxConcurrentShards of the prometheus service config
+    define the shards and how many of them are queried at the same time.
+    """
+
+    def __init__(self, prometheus_api: PrometheusAPI, service_config: dict):
+        self.prometheus_api = prometheus_api
+        self.shard_size = service_config.get("shardSize", DEFAULT_SHARD_SIZE)
+        self.max_concurrent_shards = service_config.get(
+            "maxConcurrentShards", DEFAULT_MAX_CONCURRENT_SHARDS
+        )
+
+    def get_query_step(self, start: Num, end: Num) -> str:
+        return self.prometheus_api.get_query_step(start, end)
+
+    async def query_range(
+        self,
+        query_string: str,
+        start: str,
+        end: str,
+        step: str = None,
+        timeout: int = None,
+        deadline: float = None,
+    ) -> dict:
+        """ query a time range in shards and stitch their results together
+
+        A failed shard fails the whole query, the result of the first failed
+        shard is returned and the other shard queries are cancelled.
+        """
+        start = str2timestamp(start)
+        end = str2timestamp(end)
+        if step is None:
+            step = self.get_query_step(start, end)
+        step_seconds = duration2seconds(step)
+        shard_ranges = get_shard_ranges(
+            align_timestamp(start, step_seconds),
+            align_timestamp(end, step_seconds),
+            step_seconds,
+            self.shard_size,
+        )
+        if len(shard_ranges) == 1:
+            return await self.prometheus_api.query_range(
+                query_string, start, end, step=step, timeout=timeout, deadline=deadline
+            )
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_shards)
+
+        async def query_shard(shard_start: int, shard_end: int) -> dict:
+            async with semaphore:
+                return await self.prometheus_api.query_range(
+                    query_string,
+                    shard_start,
+                    shard_end,
+                    step=step,
+                    timeout=timeout,
+                    deadline=deadline,
+                )
+
+        shard_tasks = [
+            asyncio.ensure_future(query_shard(*shard_range))
+            for shard_range in shard_ranges
+        ]
+        try:
+            shard_results = [await shard_task for shard_task in shard_tasks]
+        finally:
+            for shard_task in shard_tasks:
+                shard_task.cancel()
+
+        series_parts = {}
+        for shard_result in shard_results:
+            if shard_result.get("status") != "success":
+                return shard_result
+            for series in shard_result["data"]["result"]:
+                series_parts.setdefault(series.labels, []).append(series)
+        return {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    stitch_series(parts, step_seconds)
+                    for parts in series_parts.values()
+                ],
+            },
+        }
@@ -0,0 +1,228 @@
+""" local recognition of simple problem questions without LUIS
+
+Most questions name a known service or an instance following the
+`<service>-<p|s><n>` pattern and a simple time expression like "today" or
+"in the last 2 hours". The module recognises such questions in-process with
+one precompiled regular expression over the known service names and a small
+datetime grammar. It returns the same intent and entity shape as LUIS, so
+the LUIS round trip can be skipped. Questions with any word it does not know
+are left to LUIS.
+"""
+
+from datetime import datetime, timedelta
+import re
+
+from thumbling.luis import TIMEZONE_OFFSET
+
+
+DATE_FORMAT = "%Y-%m-%d"
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# words which may occur in a problem question besides services and datetimes
+FILLER_WORDS = frozenset(
+    """
+    a alert alerts an and any anything are at broken check did do does down
+    during error errors failed failure failures for from going had happen
+    happened has have in incident incidents instance is issue issues me my of
+    on or our outage outages please problem problems service show since the
+    there was went were what with wrong
+    """.split()
+)
+
+# LUIS resolves e.g. "last week" or "past 3 days" to date ranges of calendar
+# days, so questions with days and weeks are left to LUIS
+TIME_UNITS = {"minute": 60, "hour": 3600}
+RELATIVE_RANGE_PATTERN = re.compile(
+    r"\b(?:last|past)\s+(?:(\d+|an?|one)\s+)?(minute|hour)s?\b", re.IGNORECASE
+)
+DATE_PATTERN = re.compile(r"\b(today|yesterday)\b", re.IGNORECASE)
+WEEK_PATTERN = re.compile(r"\bthis\s+week\b", re.IGNORECASE)
+SINCE_TIME_PATTERN = re.compile(
+    r"\bsince\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b", re.IGNORECASE
+)
+AT_TIME_PATTERN = re.compile(
+    r"\bat\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b", re.IGNORECASE
+)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class LocalRecognizer:
+    """ recognise problem questions about known services and instances
+
+    recognize() returns None if the question is not fully understood.
+    The counters tell how many questions were recognised and left to LUIS.
+    """
+
+    def __init__(self, services: list, timezone_offset: int = TIMEZONE_OFFSET):
+        self.timezone_offset = timezone_offset
+        # longer names first, so a name is not shadowed by its own prefix
+        names = "|".join(
+            re.escape(name) for name in sorted(services, key=len, reverse=True)
+        )
+        self.instance_pattern = re.compile(
+            rf"\b({names})\s*-\s*([ps])\s*(\d+)\b", re.IGNORECASE
+        )
+        self.service_pattern = re.compile(rf"\b({names})\b", re.IGNORECASE)
+        self.recognized = 0
+        self.fallbacks = 0
+
+    def recognize(self, sentence: str, now: datetime = None) -> dict:
+        """ get the LUIS like problem intent of a sentence or None
+        """
+        if now is None:
+            now = datetime.utcnow() + timedelta(minutes=self.timezone_offset)
+        entities = EntityCollector()
+        self.find_target_entities(sentence, entities)
+        if not entities:
+            self.fallbacks += 1
+            return None
+
+        for match in RELATIVE_RANGE_PATTERN.finditer(sentence):
+            count, unit = match.groups()
+            count = int(count) if count and count.isdigit() else 1
+            start = now - timedelta(seconds=count * TIME_UNITS[unit.lower()])
+            entities.add(
+                match,
+                "builtin.datetimeV2.datetimerange",
+                match.group(0).lower(),
+                {
+                    "type": "datetimerange",
+                    "start": start.strftime(DATETIME_FORMAT),
+                    "end": now.strftime(DATETIME_FORMAT),
+                },
+            )
+        for match in DATE_PATTERN.finditer(sentence):
+            days = 0 if match.group(1).lower() == "today" else 1
+            date = (now - timedelta(days=days)).strftime(DATE_FORMAT)
+            entities.add(
+                match,
+                "builtin.datetimeV2.date",
+                match.group(0).lower(),
+                {"timex": date, "type": "date", "value": date},
+            )
+        for match in WEEK_PATTERN.finditer(sentence):
+            monday = now.date() - timedelta(days=now.weekday())
+            entities.add(
+                match,
+                "builtin.datetimeV2.daterange",
+                match.group(0).lower(),
+                {
+                    "type": "daterange",
+                    "start": monday.strftime(DATE_FORMAT),
+                    "end": (monday + timedelta(days=7)).strftime(DATE_FORMAT),
+                },
+            )
+        for match in SINCE_TIME_PATTERN.finditer(sentence):
+            time_value = parse_time(*match.groups())
+            if time_value is not None:
+                entities.add(
+                    match,
+                    "builtin.datetimeV2.timerange",
+                    match.group(0).lower(),
+                    {"type": "timerange", "start": time_value},
+                )
+        for match in AT_TIME_PATTERN.finditer(sentence):
+            time_value = parse_time(*match.groups())
+            if time_value is not None:
+                entities.add(
+                    match,
+                    "builtin.datetimeV2.time",
+                    match.group(0).lower(),
+                    {"type": "time", "value": time_value},
+                )
+
+        if not all(word in FILLER_WORDS for word in entities.get_other_words(sentence)):
+            self.fallbacks += 1
+            return None
+        if entities.has_date_and_time():
+            # LUIS combines e.g. "today at 9:00" to one datetime entity
+            self.fallbacks += 1
+            return None
+
+        self.recognized += 1
+        return {
+            "query": sentence,
+            "topScoringIntent": {"intent": "problem", "score": 1.0},
+            "entities": entities.get_entities(),
+        }
+
+    def find_target_entities(
+        self, sentence: str, entities: "EntityCollector" = None
+    ) -> list:
+        """ get the instance and service-name entities of a sentence
+
+        Unlike recognize() the other words are not checked, so this is only a
+        cheap guess which alerts a question is about.
+        """
+        if entities is None:
+            entities = EntityCollector()
+        for match in self.instance_pattern.finditer(sentence):
+            service, kind, number = match.groups()
+            entities.add(match, "instance", f"{service}-{kind}{number}".lower())
+        for match in self.service_pattern.finditer(sentence):
+            entities.add(match, "service-name", match.group(1).lower())
+        return entities.get_entities()
+
+
+class EntityCollector:
+    """ collect the LUIS like entities of non overlapping matches of a sentence
+    """
+
+    def __init__(self):
+        self.entities = []
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def add(self, match, entity_type: str, entity: str, resolution: dict = None):
+        start, end = match.span()
+        if any(
+            start <= other["endIndex"] and other["startIndex"] < end
+            for other in self.entities
+        ):
+            # the words already belong to another entity
+            return
+        entity = {
+            "entity": entity,
+            "type": entity_type,
+            "startIndex": start,
+            "endIndex": end - 1,
+        }
+        if resolution is not None:
+            entity["resolution"] = {"values": [resolution]}
+        self.entities.append(entity)
+
+    def has_date_and_time(self) -> bool:
+        types = {entity["type"] for entity in self.entities}
+        return "builtin.datetimeV2.date" in types and bool(
+            types & {"builtin.datetimeV2.time", "builtin.datetimeV2.timerange"}
+        )
+
+    def get_entities(self) -> list:
+        return sorted(self.entities, key=lambda entity: entity["startIndex"])
+
+    def get_other_words(self, sentence: str) -> list:
+        """ get the lower case words of the sentence which are no entity
+        """
+        remaining = list(sentence)
+        for entity in self.entities:
+            start, end = entity["startIndex"], entity["endIndex"] + 1
+            remaining[start:end] = " " * (end - start)
+        return WORD_PATTERN.findall("".join(remaining).lower())
+
+
+def parse_time(hour: str, minute: str, meridiem: str) -> str:
+    """ get the time of day as H:M:S string, None if it is ambiguous or invalid
+
+    A single number without minutes or am/pm could also be a count or a date.
+    """
+    if minute is None and meridiem is None:
+        return None
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem is not None:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}:00"
@@ -0,0 +1,188 @@
+""" circuit breakers and retries for the calls of the backends
+
+When a backend like Prometheus or LUIS is overloaded or down, every chat turn
+would wait for the full timeouts and retries would add even more load.
+The module provides a per backend ResiliencePolicy which limits the time of
+each attempt, retries failed calls with jittered exponential backoff within
+the deadline of the turn and opens a circuit breaker after repeated failures,
+so calls fail fast until the backend has recovered.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable
+
+import aiohttp
+
+
+DEFAULT_RESILIENCE_CONFIG = {
+    "retries": 2,
+    "retryBaseDelay": 0.1,
+    "retryMaxDelay": 2.0,
+    "failureThreshold": 5,
+    "recoveryTimeout": 30,
+    # seconds one attempt may take at most, so a hanging backend is a failure
+    "requestTimeout": 5,
+}
+# seconds before the deadline a timeout is caused by the deadline, as the
+# request timeouts derived from it are rounded
+DEADLINE_TOLERANCE = 0.01
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """
+    The time of the turn is used up, which is no failure of the backend
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    A backend is not called as its circuit breaker is open
+    """
+
+
+class CircuitBreaker:
+    """ stop calling a backend after consecutive failures
+
+    After failure_threshold consecutive failures the circuit opens and calls are
+    rejected. After the recovery_timeout it is half-open and a single trial call
+    is allowed, which closes the circuit on success or opens it again on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """ raise a CircuitOpenError if the backend must not be called now
+        """
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self.trial_running):
+            raise CircuitOpenError(f"the circuit of {self.name} is open")
+        if state == self.HALF_OPEN:
+            self.trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_cancellation(self):
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self.trial_running = False
+
+
+def is_retryable(error: Exception) -> bool:
+    """ check if an error is caused by a failing backend and not by the request
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def is_deadline_timeout(error: Exception, deadline: float) -> bool:
+    """ check if an error is a timeout of a request which had time until the deadline
+    """
+    return (
+        isinstance(error, asyncio.TimeoutError)
+        and time.monotonic() >= deadline - DEADLINE_TOLERANCE
+    )
+
+
+class ResiliencePolicy:
+    """ the circuit breaker and retry settings for the calls of one backend
+    """
+
+    def __init__(self, name: str, config: dict = None):
+        config = {**DEFAULT_RESILIENCE_CONFIG, **(config or {})}
+        self.retries = config["retries"]
+        self.retry_base_delay = config["retryBaseDelay"]
+        self.retry_max_delay = config["retryMaxDelay"]
+        self.request_timeout = config["requestTimeout"]
+        self.circuit_breaker = CircuitBreaker(
+            name, config["failureThreshold"], config["recoveryTimeout"]
+        )
+
+    def get_attempt_deadline(self, deadline: float = None) -> tuple:
+        """ get the deadline of an attempt and if the turn deadline shortened it
+        """
+        if self.request_timeout is None:
+            return deadline, deadline is not None
+        attempt_deadline = time.monotonic() + self.request_timeout
+        if deadline is not None and deadline <= attempt_deadline:
+            return deadline, True
+        return attempt_deadline, False
+
+    async def call(self, request: Callable[[float], Awaitable], deadline: float = None):
+        """ call the request until it succeeds, retries are used up or time is up
+
+        The deadline is a time.monotonic() timestamp. The request is called with
+        the deadline of the attempt, at most requestTimeout seconds from now, and
+        has to finish before it. Only errors of the backend are retried and
+        counted by the circuit breaker, the last one is raised. A timeout of an
+        attempt shortened by the deadline is raised as DeadlineExceededError and
+        is not counted, as a slow earlier stage of the turn may have used up the
+        time.
+        """
+        for attempt in range(self.retries + 1):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceededError("no time left to call the backend")
+            self.circuit_breaker.before_call()
+            attempt_deadline, is_shortened = self.get_attempt_deadline(deadline)
+            try:
+                result = await request(attempt_deadline)
+            except asyncio.CancelledError:
+                self.circuit_breaker.record_cancellation()
+                raise
+            except Exception as error:
+                if isinstance(error, DeadlineExceededError):
+                    self.circuit_breaker.record_cancellation()
+                    raise
+                if is_shortened and is_deadline_timeout(error, deadline):
+                    self.circuit_breaker.record_cancellation()
+                    raise DeadlineExceededError("the time of the turn is up") from error
+                if not is_retryable(error):
+                    self.circuit_breaker.record_success()
+                    raise
+                self.circuit_breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+                # full jitter: a random delay up to the exponential backoff
+                delay = random.uniform(
+                    0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+                )
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                self.circuit_breaker.record_success()
+                return result
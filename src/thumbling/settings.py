@@ -0,0 +1,132 @@
+""" the settings of the bot adapter
+
+The adapter settings hold the bot configuration and the state which is shared
+by all conversations of the bot app.
+"""
+
+import asyncio
+import os
+
+from botbuilder.core import BotFrameworkAdapterSettings
+
+from thumbling.admission import AdmissionControl
+from thumbling.cache import create_cache
+from thumbling.config_registry import (
+    DEFAULT_WATCH_INTERVAL,
+    ConfigRegistry,
+    ConfigSnapshot,
+)
+from thumbling.luis import DEFAULT_INTENT_CACHE_TTL, IntentCache
+from thumbling.metrics import BotMetrics
+from thumbling.prometheus import LatencyTracker
+from thumbling.recognizer import LocalRecognizer
+from thumbling.resilience import ResiliencePolicy
+from thumbling.singleflight import SingleFlight
+from thumbling.tracing import Tracer
+
+
+class ThumblingBotAdpaterSettings(BotFrameworkAdapterSettings):
+    """ extended adapter settings to have the bot config available in each TurnContext
+
+    With Adapter initialization the .bot configuration file is loaded as well,
+    and based on the environment the app settings provide to it.
+    The config registry reloads the file on changes while the app runs and the
+    complete current configuration is also stored in the config property.
+    Only the service configs read per turn and the recognizer follow the
+    changes, the rest of the settings need a restart.
+    The shared HTTP client session is created and closed with the app.
+    The admission control limits the messages per conversation and user and
+    the query limiter the concurrent Prometheus queries of all conversations.
+    The query and intent caches and singleflights, the local recognizer,
+    Prometheus latencies and the resilience policies of the backends are shared
+    by all conversations, as well as the metrics and the tracer of the bot.
+    With the sqlite cache backend the caches are also shared by the worker
+    processes.
+    """
+
+    def __init__(self):
+        self.config_registry = ConfigRegistry(
+            os.getenv("botFilePath", default="./thumbling.bot"),
+            os.getenv("botFileSecret"),
+        )
+        self.watch_interval = float(
+            os.getenv("botFileWatchInterval", default=DEFAULT_WATCH_INTERVAL)
+        )
+        self.config_watch = None
+        self.environment = os.getenv("APP_ENVIRONMENT", default="development")
+        snapshot = self.config_registry.snapshot
+        endpoint_config = snapshot.get_service_config(
+            "services", "endpoint", self.environment
+        )
+        self.http_client_config = snapshot.get_optional_service_config(
+            "custom_services", "http_client", self.environment
+        )
+        self.client_session = None
+        self.turn_queue_config = snapshot.get_optional_service_config(
+            "custom_services", "turn_queue", self.environment
+        )
+        self.turn_queue = None
+        admission_config = snapshot.get_optional_service_config(
+            "custom_services", "admission", self.environment
+        )
+        self.admission = (
+            AdmissionControl(admission_config) if admission_config else None
+        )
+        max_queries = admission_config.get("maxGlobalQueries")
+        self.query_limiter = asyncio.Semaphore(max_queries) if max_queries else None
+        prometheus_config = snapshot.get_service_config(
+            "custom_services", "prometheus", self.environment
+        )
+        cache_config = snapshot.get_optional_service_config(
+            "custom_services", "cache", self.environment
+        )
+        self.query_cache = create_cache(
+            cache_config, "queries", prometheus_config.get("cacheMaxEntries", 256)
+        )
+        self.prometheus_latencies = LatencyTracker()
+        luis_config = snapshot.get_service_config("services", "luis", "production")
+        intent_cache_size = luis_config.get("cacheMaxEntries", 1024)
+        self.intent_cache = IntentCache(
+            intent_cache_size,
+            luis_config.get("cacheTtl", DEFAULT_INTENT_CACHE_TTL),
+            create_cache(cache_config, "intents", intent_cache_size),
+        )
+        self.query_singleflight = SingleFlight()
+        self.intent_singleflight = SingleFlight()
+        self.metrics = BotMetrics(
+            {"queries": self.query_cache, "intents": self.intent_cache},
+            {"prometheus": self.query_singleflight, "luis": self.intent_singleflight},
+        )
+        self.tracer = Tracer(
+            snapshot.get_optional_service_config(
+                "custom_services", "tracing", self.environment
+            )
+        )
+        resilience_config = snapshot.get_optional_service_config(
+            "custom_services", "resilience", self.environment
+        )
+        self.resilience = {
+            backend: ResiliencePolicy(backend, resilience_config.get(backend))
+            for backend in ["prometheus", "luis"]
+        }
+        self.apply_config(snapshot)
+        self.config_registry.add_listener(self.apply_config)
+        super().__init__(endpoint_config["appId"], endpoint_config["appPassword"])
+
+    @property
+    def config(self) -> dict:
+        return self.config_registry.snapshot.config
+
+    def apply_config(self, snapshot: ConfigSnapshot):
+        """ check a configuration snapshot and update the settings derived from it
+        """
+        snapshot.get_service_config("custom_services", "prometheus", self.environment)
+        snapshot.get_service_config("services", "luis", "production")
+        recognizer_config = snapshot.get_optional_service_config(
+            "custom_services", "recognizer", self.environment
+        )
+        self.recognizer = (
+            LocalRecognizer(recognizer_config["services"])
+            if recognizer_config.get("services")
+            else None
+        )
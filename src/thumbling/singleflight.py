@@ -0,0 +1,71 @@
+""" deduplication of concurrent identical backend requests
+
+During an incident many people ask about the same service within seconds.
+Their turns would send the same Prometheus queries and LUIS requests at the
+same time, before the first result is in the cache. A SingleFlight runs one
+call per key and lets the concurrent callers with the same key wait for it.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """ share the in-flight call of a key between its concurrent callers
+
+    The call runs in its own task, so a cancelled caller does not cancel it
+    for the other callers. It is cancelled when all its callers are cancelled.
+    Its result or exception is passed to all callers, so results must not be
+    changed. The call uses the arguments, e.g. the deadline, of the first caller.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        # calls which were started and calls which joined a running one
+        self.started = 0
+        self.collapsed = 0
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        flight = self.calls.get(key)
+        if flight is None:
+            flight = self.calls[key] = Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda task: self.remove(key, flight))
+            self.started += 1
+        else:
+            self.collapsed += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # new callers must not join a cancelled call
+                self.remove(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def remove(self, key: Hashable, flight: "Flight"):
+        if self.calls.get(key) is flight:
+            del self.calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self),
+            "started": self.started,
+            "collapsed": self.collapsed,
+        }
+
+
+class Flight:
+    """ a running call and the number of its waiting callers
+    """
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
@@ -0,0 +1,193 @@
+""" timing trees of single turns
+
+The metrics show the latency distribution of all turns, but not why one turn
+was slow. The tracer records a span for the turn and nested spans for its
+stages, e.g. the LUIS request, each Prometheus query, the card building and each
+send. The current span is kept in a context variable, so spans of tasks started
+within a turn are nested below the span which started them. When the turn ends
+its spans are logged with the turn ID and optionally appended to a file as a
+line of OTLP JSON, which can be read by an OpenTelemetry collector.
+Outside of a turn span() does nothing.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+from typing import Iterator
+
+
+logger = logging.getLogger(__name__)
+
+CURRENT_SPAN = contextvars.ContextVar("thumbling_current_span", default=None)
+
+
+class Span:
+    """ a named and timed part of a turn
+    """
+
+    __slots__ = (
+        "trace",
+        "name",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.attributes = attributes
+        self.error = None
+
+    def to_dict(self) -> dict:
+        """ a compact representation with times in ms since the turn start
+        """
+        turn_start = self.trace.spans[0].start_time
+        span = {
+            "name": self.name,
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "start": round((self.start_time - turn_start) / 1e6, 3),
+            "duration": round((self.end_time - self.start_time) / 1e6, 3),
+        }
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.error:
+            span["error"] = self.error
+        return span
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """ the spans of one turn, the first one is the span of the turn itself
+    """
+
+    def __init__(self, turn_id: str):
+        self.turn_id = turn_id
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans = []
+
+    def finished_spans(self) -> list:
+        return [span for span in self.spans if span.end_time is not None]
+
+
+@contextlib.contextmanager
+def record_span(trace: Trace, name: str, parent_id: str, attributes: dict):
+    span = Span(trace, name, parent_id, attributes)
+    trace.spans.append(span)
+    token = CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.error = type(error).__name__
+        raise
+    finally:
+        span.end_time = time.time_ns()
+        CURRENT_SPAN.reset(token)
+
+
+def span(name: str, **attributes) -> contextlib.AbstractContextManager:
+    """ record a span below the current span if there is one
+    """
+    parent = CURRENT_SPAN.get()
+    if parent is None:
+        return contextlib.nullcontext()
+    return record_span(parent.trace, name, parent.span_id, attributes)
+
+
+class Tracer:
+    """ trace turns and export their spans when they end
+
+    The optional tracing custom service config can disable the tracing with
+    enabled false and set the exportPath of the OTLP JSON file.
+    """
+
+    def __init__(self, config: dict = None):
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.export_path = config.get("exportPath")
+
+    @contextlib.contextmanager
+    def turn(self, turn_id: str, **attributes) -> Iterator[Trace]:
+        """ record the span of a turn, the stages are recorded with span()
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(turn_id)
+        try:
+            with record_span(trace, "turn", None, {"turn_id": turn_id, **attributes}):
+                yield trace
+        finally:
+            self.export(trace)
+
+    def export(self, trace: Trace):
+        """ log and export the finished spans of the trace
+
+        Spans of tasks which outlive the turn, e.g. hedged requests, are left out.
+        """
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "turn %s trace %s spans %s",
+                trace.turn_id,
+                trace.trace_id,
+                json.dumps([span.to_dict() for span in trace.finished_spans()]),
+                extra={"turn_id": trace.turn_id, "trace_id": trace.trace_id},
+            )
+        if self.export_path is not None:
+            try:
+                with open(self.export_path, "a") as fo:
+                    fo.write(json.dumps(to_otlp(trace)) + "\n")
+            except OSError:
+                logger.exception("could not export the trace %s", trace.trace_id)
+
+
+def to_otlp(trace: Trace) -> dict:
+    """ the spans of a trace as OTLP JSON request of the trace service
+    """
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": "thumbling"}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [span.to_otlp() for span in trace.finished_spans()],
+                    }
+                ],
+            }
+        ]
+    }
@@ -0,0 +1,109 @@
+""" asynchronous processing of turns with proactive replies
+
+Answering a message needs LUIS and Prometheus requests, which can take longer
+than the channel waits for the HTTP response of the bot, so the channel would
+deliver the message again. The turn queue acknowledges a message at once and
+processes it later with a fixed number of worker tasks. The replies are sent
+proactively with the conversation reference of the message. The queue is
+bounded, so a full queue can be answered with backpressure instead.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from botbuilder.core import BotAdapter, TurnContext
+
+
+DEFAULT_TURN_QUEUE_CONFIG = {
+    "maxQueuedTurns": 100,
+    "turnWorkers": 4,
+    "retryAfter": 5,
+    "drainTimeout": 10,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """
+    The turn queue is full and the turn can not be processed now
+    """
+
+
+class TurnQueue:
+    """ a bounded queue of turns which are processed by worker tasks
+
+    submit() is used as the bot logic of the adapter, it only stores the
+    authenticated activity. The workers continue the conversation of each
+    queued activity and run the handler with it.
+    """
+
+    def __init__(
+        self,
+        adapter: BotAdapter,
+        handler: Callable[[TurnContext], Awaitable],
+        config: dict = None,
+    ):
+        config = {**DEFAULT_TURN_QUEUE_CONFIG, **(config or {})}
+        self.adapter = adapter
+        self.handler = handler
+        self.num_workers = config["turnWorkers"]
+        self.retry_after = config["retryAfter"]
+        self.drain_timeout = config["drainTimeout"]
+        self.queue = asyncio.Queue(config["maxQueuedTurns"])
+        self.workers = []
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    def start(self):
+        """ start the workers, must be called with a running event loop
+        """
+        self.workers = [
+            asyncio.ensure_future(self.work()) for _ in range(self.num_workers)
+        ]
+
+    async def stop(self):
+        """ process the queued turns for at most the drain timeout and stop
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("stopped with %s unprocessed turns", self.queue.qsize())
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    async def submit(self, context: TurnContext):
+        """ queue the activity of a turn or raise a QueueFullError
+        """
+        try:
+            self.queue.put_nowait(
+                (
+                    context.activity,
+                    TurnContext.get_conversation_reference(context.activity),
+                    context.turn_state.get(BotAdapter.BOT_IDENTITY_KEY),
+                )
+            )
+        except asyncio.QueueFull:
+            raise QueueFullError(f"{self.queue.qsize()} turns are queued already")
+
+    async def work(self):
+        while True:
+            activity, reference, claims_identity = await self.queue.get()
+
+            async def process_turn(context: TurnContext):
+                # the continued context has an event activity, but the handler
+                # needs the message
+                context.activity = activity
+                await self.handler(context)
+
+            try:
+                await self.adapter.continue_conversation(
+                    reference, process_turn, claims_identity=claims_identity
+                )
+            except Exception:
+                logger.exception("could not process the turn %s", activity.id)
+            finally:
+                self.queue.task_done()
@@ -1,11 +1,10 @@
 import base64
 import copy
+from datetime import datetime, timezone
+from functools import lru_cache
 import json
 from uuid import UUID
 
-from Crypto.Cipher import AES
-import iso8601
-
 
 ENCRYPTED_PROPERTIES = {
     "abs": ["endpointKey", "subscriptionKey"],
@@ -36,6 +35,9 @@ def decrypt_string(encrypted_string: str, key: str) -> str:
     if not key:
         raise BotConfigError("not secret provided for decryption")
 
+    # only needed for encrypted bot files, so it is imported on first use
+    from Crypto.Cipher import AES
+
     iv_base64, content_base64 = encrypted_string.split("!")
     aes = AES.new(base64.b64decode(key), AES.MODE_CBC, base64.b64decode(iv_base64))
     return _unpad(aes.decrypt(base64.b64decode(content_base64)).decode("utf-8"))
@@ -93,8 +95,44 @@ def get_service_config(service_section: list, service_type: str, name: str) -> d
     return service[0]
 
 
+def get_optional_service_config(
+    service_section: list, service_type: str, name: str
+) -> dict:
+    """ get a service config entry or an empty config if there is none
+    """
+    service = [
+        service_entry
+        for service_entry in service_section
+        if service_entry["type"] == service_type and service_entry["name"] == name
+    ]
+    if len(service) > 1:
+        raise BotConfigError(
+            f"could not find at most one service config entry, instead {len(service)}"
+        )
+
+    return service[0] if service else {}
+
+
 def str2timestamp(t: str) -> int:
     try:
         return int(t)
     except ValueError:
+        return parse_iso_timestamp(t)
+
+
+@lru_cache(maxsize=1024)
+def parse_iso_timestamp(t: str) -> int:
+    """ parse an ISO 8601 string to a timestamp, without timezone as UTC
+
+    The fast datetime.fromisoformat is used and iso8601 only for the formats
+    it does not support. The results are memoised as LUIS values repeat a lot.
+    """
+    try:
+        parsed = datetime.fromisoformat(t)
+    except ValueError:
+        import iso8601
+
         return int(iso8601.parse_date(t).timestamp())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
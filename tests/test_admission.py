@@ -0,0 +1,71 @@
+import asyncio
+
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from thumbling.admission import AdmissionControl, RateLimiter
+from thumbling.prometheus import PrometheusAPI
+
+
+def create_activity(conversation: str, user: str) -> Activity:
+    return Activity(
+        type="message",
+        channel_id="test",
+        conversation=ConversationAccount(id=conversation),
+        from_property=ChannelAccount(id=user),
+    )
+
+
+def test_rate_limiter(clock):
+    limiter = RateLimiter(rate=0.5, burst=2, max_keys=2, clock=clock)
+    assert limiter.get_tokens("a") == 2
+    limiter.consume("a")
+    limiter.consume("a")
+    assert limiter.get_tokens("a") == 0
+    clock.now = 1
+    assert limiter.get_tokens("a") == 0.5
+    clock.now = 10
+    assert limiter.get_tokens("a") == 2
+    limiter.get_tokens("b")
+    limiter.get_tokens("c")
+    assert len(limiter) == 2
+
+
+def test_admission_control(clock):
+    admission = AdmissionControl(
+        {"conversationBurst": 2, "userBurst": 3, "userRate": 0.1}, clock
+    )
+    assert admission.check(create_activity("chat-1", "alice")) is None
+    assert admission.check(create_activity("chat-1", "alice")) is None
+    assert admission.check(create_activity("chat-1", "bob")) == "conversation"
+    assert admission.check(create_activity("chat-2", "alice")) is None
+    # the rejected message took no token of the conversation
+    assert admission.check(create_activity("chat-3", "alice")) == "user"
+    assert admission.check(create_activity("chat-3", "bob")) is None
+    clock.now = 2
+    assert admission.check(create_activity("chat-1", "bob")) is None
+
+
+def test_query_limiter():
+    running = {"current": 0, "max": 0}
+
+    async def request(*args, **kwargs):
+        running["current"] += 1
+        running["max"] = max(running["max"], running["current"])
+        await asyncio.sleep(0.01)
+        running["current"] -= 1
+        return {"status": "success", "data": {"result": []}}
+
+    async def run():
+        query_limiter = asyncio.Semaphore(2)
+        apis = [
+            PrometheusAPI({"endpoint": "http://localhost"}, query_limiter=query_limiter)
+            for _ in range(5)
+        ]
+        for api in apis:
+            api._hedged_request = request
+        await asyncio.gather(
+            *(api.query_range(f"ALERTS{i}", 0, 60) for i, api in enumerate(apis))
+        )
+
+    asyncio.run(run())
+    assert running["max"] == 2
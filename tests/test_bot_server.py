@@ -0,0 +1,105 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from thumbling import bot_server
+from thumbling.admission import AdmissionControl
+from thumbling.metrics import BotMetrics
+
+
+BOT_FILE_PATH = os.path.join(os.path.dirname(__file__), "..", "thumbling.bot")
+
+
+def test_app_startup_ready_and_activity(monkeypatch):
+    monkeypatch.setenv("botFilePath", BOT_FILE_PATH)
+    monkeypatch.setenv("botFileWatchInterval", "0")
+
+    async def run():
+        app = bot_server.create_app()
+        assert not bot_server.READY
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(server.make_url("/ready")) as resp:
+                    assert resp.status == 200
+                async with session.get(server.make_url("/metrics")) as resp:
+                    assert resp.status == 200
+                    assert "thumbling_turns_in_flight" in await resp.text()
+                activity = {
+                    "type": "conversationUpdate",
+                    "id": "1",
+                    "channelId": "test",
+                    "serviceUrl": "http://localhost",
+                    "conversation": {"id": "conversation"},
+                    "from": {"id": "user"},
+                    "recipient": {"id": "bot"},
+                }
+                url = server.make_url("/api/messages")
+                async with session.post(url, json=activity) as resp:
+                    assert resp.status == 201
+        assert not bot_server.READY
+
+    asyncio.run(run())
+
+
+def test_admin_profile(monkeypatch):
+    monkeypatch.setenv("adminToken", "secret")
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get("/admin/profile", bot_server.profile)])
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as session:
+                url = server.make_url("/admin/profile")
+                async with session.get(url) as resp:
+                    assert resp.status == 401
+                headers = {"Authorization": "Bearer secret"}
+                params = {"seconds": "0.1"}
+                async with session.get(url, params=params, headers=headers) as resp:
+                    assert resp.status == 200
+                    stacks = await resp.text()
+        # the event loop waits in its selector while nothing else runs
+        assert "select" in stacks
+        assert bot_server.PROFILER is None
+
+    asyncio.run(run())
+
+
+def test_admit_rejects_messages_over_the_rate_limits(monkeypatch):
+    settings = SimpleNamespace(
+        admission=AdmissionControl({"conversationBurst": 1}), metrics=BotMetrics()
+    )
+    monkeypatch.setattr(bot_server, "SETTINGS", settings)
+    handled = []
+    sent = []
+
+    async def handler(context):
+        handled.append(context.activity.text)
+
+    async def send_activity(activity):
+        sent.append(activity.text)
+
+    context = SimpleNamespace(
+        activity=Activity(
+            type="message",
+            text="problems with euler?",
+            channel_id="test",
+            conversation=ConversationAccount(id="conversation"),
+            from_property=ChannelAccount(id="user"),
+            recipient=ChannelAccount(id="bot"),
+        ),
+        adapter=SimpleNamespace(settings=settings),
+        send_activity=send_activity,
+    )
+    admission_handler = bot_server.admit(handler)
+    asyncio.run(admission_handler(context))
+    asyncio.run(admission_handler(context))
+
+    assert handled == ["problems with euler?"]
+    assert sent == [settings.admission.busy_message]
+    assert settings.metrics.rejected_turns.values == {("conversation",): 1}
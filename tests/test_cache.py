@@ -0,0 +1,89 @@
+import sqlite3
+import time
+
+import pytest
+
+from thumbling.cache import SQLiteCache, TTLCache, create_cache
+from thumbling.utils import BotConfigError
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_ttl_cache_expiry(clock):
+    cache = TTLCache(clock=clock)
+    cache.set("recent", 1, ttl=30)
+    cache.set("past", 2)
+    clock.now = 29
+    assert cache.get("recent") == 1
+    clock.now = 30
+    assert cache.get("recent") is None
+    assert cache.get("past") == 2
+    assert len(cache) == 1
+
+
+def test_sqlite_cache_is_shared(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path, "queries", max_size=2, clock=clock)
+    other = SQLiteCache(path, "queries", max_size=2, clock=clock)
+    cache.set(("up", 60), {"status": "success"}, ttl=30)
+    assert other.get(("up", 60)) == {"status": "success"}
+    assert other.get(("down", 60)) is None
+    assert other.stats() == {"size": 1, "hits": 1, "misses": 1, "busy": 0}
+    assert len(SQLiteCache(path, "intents")) == 0
+    clock.now = 30
+    assert cache.get(("up", 60)) is None
+    # expired entries are removed by the next write
+    cache.set(("down", 60), {"status": "success"})
+    assert len(other) == 1
+
+
+def test_sqlite_cache_eviction_of_oldest_entries(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_size=2, clock=clock)
+    cache.set("a", 1)
+    clock.now = 1
+    cache.set("b", 2)
+    clock.now = 2
+    assert cache.get("a") == 1
+    clock.now = 3
+    cache.set("c", 3)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") == 3
+
+
+def test_sqlite_cache_busy(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path)
+    cache.set("a", 1)
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    start = time.monotonic()
+    # the write is given up at once, reads are not blocked by the writer
+    cache.set("b", 2)
+    assert time.monotonic() - start < 1
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()["busy"] == 1
+    writer.execute("ROLLBACK")
+    writer.close()
+
+
+def test_create_cache(tmp_path):
+    assert isinstance(create_cache({}, "queries", 10), TTLCache)
+    cache = create_cache(
+        {"backend": "sqlite", "path": str(tmp_path / "cache.sqlite")}, "queries", 10
+    )
+    assert isinstance(cache, SQLiteCache)
+    assert cache.max_size == 10
+    with pytest.raises(BotConfigError):
+        create_cache({"backend": "redis"}, "queries", 10)
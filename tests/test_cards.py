@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from thumbling.cards import create_simple_alert_card
 
 
@@ -83,3 +85,23 @@ def test_create_simple_alert_card():
         ],
     }
     assert result == expected
+
+
+def test_create_simple_alert_card_episodes():
+    alert = {
+        "metric": {"alertname": "ServiceDown"},
+        "values": [[1540251900, "1"], [1540251960, "1"], [1540255500, "1"]],
+    }
+    result = create_simple_alert_card([alert], 1540000000, 1541000000, step=60)
+    texts = [item["text"] for item in result["body"][1]["items"]]
+    # the card shows local times
+    first_start, first_end, second = [
+        datetime.fromtimestamp(timestamp)
+        for timestamp in [1540251900, 1540251960, 1540255500]
+    ]
+    assert texts == [
+        f"{first_start} - {first_end}",
+        "ServiceDown",
+        f"{second} - {second}",
+        "ServiceDown",
+    ]
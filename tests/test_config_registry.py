@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from thumbling.config_registry import ConfigRegistry, ConfigSnapshot
+from thumbling.utils import BotConfigError
+
+
+CONFIG = {
+    "services": [{"type": "luis", "name": "production", "subscriptionKey": "old"}],
+    "custom_services": [
+        {"type": "prometheus", "name": "development"},
+        {"type": "resilience", "name": "development"},
+        {"type": "resilience", "name": "development"},
+    ],
+}
+
+
+def test_config_snapshot_lookup():
+    snapshot = ConfigSnapshot(CONFIG)
+    assert snapshot.get_service_config("services", "luis", "production") == (
+        CONFIG["services"][0]
+    )
+    assert (
+        snapshot.get_optional_service_config(
+            "custom_services", "recognizer", "development"
+        )
+        == {}
+    )
+    with pytest.raises(BotConfigError):
+        snapshot.get_service_config("custom_services", "prometheus", "production")
+    with pytest.raises(BotConfigError):
+        snapshot.get_optional_service_config(
+            "custom_services", "resilience", "development"
+        )
+
+
+def test_config_registry_reload(tmpdir):
+    bot_file = tmpdir.join("test.bot")
+    bot_file.write(json.dumps(CONFIG))
+    registry = ConfigRegistry(str(bot_file))
+    old_snapshot = registry.snapshot
+    loaded = []
+    registry.add_listener(loaded.append)
+    assert not registry.reload_if_changed()
+
+    luis_config = {**CONFIG["services"][0], "subscriptionKey": "new"}
+    new_config = {**CONFIG, "services": [luis_config]}
+    bot_file.write(json.dumps(new_config))
+    os.utime(str(bot_file), ns=(0, 10 ** 9))
+    assert registry.reload_if_changed()
+    assert loaded == [registry.snapshot]
+    luis_config = registry.snapshot.get_service_config("services", "luis", "production")
+    assert luis_config["subscriptionKey"] == "new"
+    # turns which took the old snapshot keep it
+    luis_config = old_snapshot.get_service_config("services", "luis", "production")
+    assert luis_config["subscriptionKey"] == "old"
+
+    # an incomplete file keeps the previous snapshot active
+    bot_file.write("{")
+    os.utime(str(bot_file), ns=(0, 2 * 10 ** 9))
+    assert not registry.reload_if_changed()
+    assert registry.reload_errors == 1
+    assert registry.snapshot is loaded[0]
@@ -0,0 +1,276 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from thumbling import conversation, prometheus
+from thumbling.config_registry import ConfigRegistry, ConfigSnapshot
+from thumbling.metrics import BotMetrics
+from thumbling.recognizer import LocalRecognizer
+
+
+class FakeContext:
+    def __init__(self, prometheus_config: dict):
+        self.activity = Activity(
+            type="message",
+            text="any problems with euler-p1, euler-p2 or euler-s1?",
+            channel_id="test",
+            conversation=ConversationAccount(id="conversation"),
+            from_property=ChannelAccount(id="user"),
+            recipient=ChannelAccount(id="bot"),
+            service_url="http://localhost",
+        )
+        settings = SimpleNamespace(
+            config_registry=ConfigRegistry(
+                config={
+                    "services": [{"type": "luis", "name": "production"}],
+                    "custom_services": [prometheus_config],
+                }
+            ),
+            environment="development",
+            client_session=None,
+            query_cache=None,
+            prometheus_latencies=None,
+            resilience={"prometheus": None, "luis": None},
+            intent_cache=None,
+            recognizer=None,
+            metrics=BotMetrics(),
+            query_singleflight=None,
+            intent_singleflight=None,
+            query_limiter=None,
+        )
+        self.adapter = SimpleNamespace(settings=settings)
+        self.sent_activities = []
+
+    async def send_activity(self, activity: Activity):
+        self.sent_activities.append(activity)
+
+
+@pytest.fixture
+def problem_intent():
+    return {
+        "entities": [
+            {"type": "instance", "entity": "euler-p1"},
+            {"type": "instance", "entity": "euler-p2"},
+            {"type": "instance", "entity": "euler-s1"},
+            {
+                "type": "builtin.datetimeV2.date",
+                "resolution": {"values": [{"value": "2018-10-23"}]},
+            },
+        ]
+    }
+
+
+def test_handle_problem_intent_concurrent_and_ordered(monkeypatch, problem_intent):
+    running = {"current": 0, "max": 0}
+    queries = []
+
+    async def query_range(self, query_string, start, end, step, timeout, deadline):
+        queries.append(query_string)
+        running["current"] += 1
+        running["max"] = max(running["max"], running["current"])
+        # the first query is the slowest one
+        await asyncio.sleep(0.03 if "euler-p1" in query_string else 0.01)
+        running["current"] -= 1
+        if "euler-s1" in query_string:
+            raise aiohttp.ClientPayloadError("broken response")
+        return {"status": "success", "data": {"result": []}}
+
+    monkeypatch.setattr(prometheus.PrometheusAPI, "query_range", query_range)
+    context = FakeContext(
+        {
+            "type": "prometheus",
+            "name": "development",
+            "endpoint": "http://localhost:9000",
+            "maxConcurrentQueries": 2,
+            "maxSelectorLength": 24,
+            "shardSize": 10 * 86400,
+        }
+    )
+
+    asyncio.run(conversation.handle_problem_intent(context, problem_intent))
+
+    assert queries == [
+        'ALERTS{instance=~"euler\\\\-p1|euler\\\\-p2"}',
+        'ALERTS{instance="euler-s1"}',
+    ]
+    assert running["max"] == 2
+    assert [activity.text for activity in context.sent_activities] == [
+        "There were the following alerts:",
+        "There were the following alerts:",
+        "\U000026A0 There was a problem querying the Prometheus server.",
+    ]
+    metrics = context.adapter.settings.metrics
+    assert metrics.errors.values == {("query_range",): 1}
+    assert metrics.stage_duration.values[("send_activity",)][0][-1] == 0
+    assert sum(metrics.stage_duration.values[("send_activity",)][0]) == 3
+
+
+@pytest.mark.parametrize("stream_responses", [False, True])
+def test_handle_problem_intent_invalid_response(problem_intent, stream_responses):
+    async def query_range(request):
+        if "euler-s1" in request.rel_url.query["query"]:
+            # e.g. the login page of an authentication proxy
+            return web.Response(text="<html>login</html>", content_type="text/html")
+        data = {"resultType": "matrix", "result": []}
+        return web.json_response({"status": "success", "data": data})
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get("/api/v1/query_range", query_range)])
+        async with TestServer(app) as server:
+            context = FakeContext(
+                {
+                    "type": "prometheus",
+                    "name": "development",
+                    "endpoint": str(server.make_url("/")),
+                    "maxSelectorLength": 24,
+                    "streamResponses": stream_responses,
+                }
+            )
+            await conversation.handle_problem_intent(context, problem_intent)
+        return context
+
+    context = asyncio.run(run())
+    assert [activity.text for activity in context.sent_activities] == [
+        "There were the following alerts:",
+        "There were the following alerts:",
+        "\U000026A0 There was a problem querying the Prometheus server.",
+    ]
+
+
+@pytest.mark.parametrize("stream_responses", [False, True])
+def test_handle_problem_intent_truncated_response(problem_intent, stream_responses):
+    async def query_range(request):
+        data = {"resultType": "matrix", "result": []}
+        body = web.json_response({"status": "success", "data": data}).text
+        if "p1" in request.rel_url.query["query"]:
+            body = body[:20]
+        return web.Response(text=body, content_type="application/json")
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get("/api/v1/query_range", query_range)])
+        async with TestServer(app) as server:
+            context = FakeContext(
+                {
+                    "type": "prometheus",
+                    "name": "development",
+                    "endpoint": str(server.make_url("/")),
+                    "maxSelectorLength": 24,
+                    "streamResponses": stream_responses,
+                }
+            )
+            await conversation.handle_problem_intent(context, problem_intent)
+        return context
+
+    context = asyncio.run(run())
+    # the query of euler-s1 is not cancelled by the coalesced one of euler-p1
+    assert [activity.text for activity in context.sent_activities] == [
+        "\U000026A0 There was a problem querying the Prometheus server.",
+        "There were the following alerts:",
+    ]
+    assert context.adapter.settings.metrics.errors.values == {("query_range",): 1}
+@pytest.mark.parametrize("intent", ["problem", "None"])
+def test_handle_initial_message_speculative_prefetch(monkeypatch, intent):
+    queries = []
+    cancelled = []
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    async def query_range(self, query_string, start, end, step, timeout, deadline):
+        queries.append(query_string)
+        try:
+            await asyncio.sleep(0.02)
+        except asyncio.CancelledError:
+            cancelled.append(query_string)
+            raise
+        return {"status": "success", "data": {"result": []}}
+
+    async def get_message_intent(service_config, sentence, **kwargs):
+        # the prefetch runs while LUIS is requested
+        await asyncio.sleep(0.01)
+        return {
+            "topScoringIntent": {"intent": intent, "score": 0.9},
+            "entities": [
+                {"type": "instance", "entity": "euler-p1"},
+                {
+                    "type": "builtin.datetimeV2.date",
+                    "resolution": {"values": [{"value": today}]},
+                },
+            ],
+        }
+
+    monkeypatch.setattr(prometheus.PrometheusAPI, "query_range", query_range)
+    monkeypatch.setattr(conversation, "get_message_intent", get_message_intent)
+    context = FakeContext(
+        {
+            "type": "prometheus",
+            "name": "development",
+            "endpoint": "http://localhost:9000",
+            "speculativePrefetch": True,
+            "shardSize": 10 * 86400,
+        }
+    )
+    context.adapter.settings.recognizer = LocalRecognizer(["euler"])
+    context.activity.text = "euler-p1 behaves strangely"
+    asyncio.run(conversation.handle_initial_message(context))
+
+    assert queries == ['ALERTS{instance="euler-p1"}']
+    assert context.adapter.settings.metrics.intents.values == {(intent, "luis"): 1}
+    if intent == "problem":
+        assert not cancelled
+        assert context.sent_activities[0].text == "There were the following alerts:"
+    else:
+        assert cancelled == queries
+
+
+def test_handle_initial_message_too_long():
+    context = FakeContext({"type": "prometheus", "name": "development"})
+    context.activity.text = "euler " * 100
+    asyncio.run(conversation.handle_initial_message(context))
+    assert [activity.text for activity in context.sent_activities] == [
+        "Sorry, your message is too long for me. Please ask a shorter question."
+    ]
+
+
+def test_handle_initial_message_keeps_its_snapshot(monkeypatch):
+    endpoints = []
+
+    async def query_range(self, query_string, start, end, step, timeout, deadline):
+        endpoints.append(self.base_url)
+        return {"status": "success", "data": {"result": []}}
+
+    async def get_message_intent(service_config, sentence, **kwargs):
+        # the bot file is reloaded while LUIS is requested
+        context.adapter.settings.config_registry.snapshot = ConfigSnapshot(
+            {
+                "services": [{"type": "luis", "name": "production"}],
+                "custom_services": [{**prometheus_config, "endpoint": "http://new"}],
+            }
+        )
+        return {
+            "topScoringIntent": {"intent": "problem", "score": 0.9},
+            "entities": [
+                {"type": "instance", "entity": "euler-p1"},
+                {
+                    "type": "builtin.datetimeV2.date",
+                    "resolution": {"values": [{"value": "2018-10-23"}]},
+                },
+            ],
+        }
+
+    monkeypatch.setattr(prometheus.PrometheusAPI, "query_range", query_range)
+    monkeypatch.setattr(conversation, "get_message_intent", get_message_intent)
+    prometheus_config = {
+        "type": "prometheus",
+        "name": "development",
+        "endpoint": "http://old",
+    }
+    context = FakeContext(prometheus_config)
+    asyncio.run(conversation.handle_initial_message(context))
+    assert set(endpoints) == {"http://old"}
@@ -0,0 +1,52 @@
+import copy
+from datetime import datetime
+
+from thumbling.datetime_resolver import resolve_time_ranges, timex_duration2seconds
+
+
+NOW = datetime(2018, 10, 24, 12, 0).timestamp()
+
+
+def today_at(hour: int) -> int:
+    return int(datetime(2018, 10, 24, hour).timestamp())
+
+
+def datetime_entity(subtype: str, *values) -> dict:
+    return {
+        "type": f"builtin.datetimeV2.{subtype}",
+        "resolution": {"values": list(values)},
+    }
+
+
+def test_resolve_time_ranges_all_subtypes():
+    entities = [
+        {"type": "instance", "entity": "euler-p1"},
+        datetime_entity("date", {"value": "2018-10-23"}, {"value": "2018-10-30"}),
+        datetime_entity("time", {"value": "09:00:00"}),
+        datetime_entity("timerange", {"start": "10:00:00"}),
+        datetime_entity("daterange", {"start": "2018-10-22", "end": "2018-10-23"}),
+        datetime_entity("datetime", {"value": "2018-10-24 08:00:00"}),
+        datetime_entity("duration", {"value": "3600"}),
+        datetime_entity("set", {"timex": "P1D", "value": "not resolved"}),
+        datetime_entity("set", {"timex": "XXXX-WXX-1", "value": "not resolved"}),
+    ]
+    original_entities = copy.deepcopy(entities)
+    latest = int(NOW) - 30
+
+    assert resolve_time_ranges(entities, NOW) == [
+        # the future date is dropped
+        (int(datetime(2018, 10, 23).timestamp()), today_at(0)),
+        (today_at(9) - 300, today_at(9) + 300),
+        (today_at(10), latest),
+        (1540166400, 1540252800),
+        (1540368000 - 300, 1540368000 + 300),
+        (int(NOW) - 3600, latest),
+        (int(NOW) - 86400, latest),
+    ]
+    assert entities == original_entities
+
+
+def test_timex_duration2seconds():
+    assert timex_duration2seconds("PT2H30M") == 9000
+    assert timex_duration2seconds("P1W") == 604800
+    assert timex_duration2seconds("XXXX-WXX-1") == 0
@@ -0,0 +1,32 @@
+import asyncio
+
+from thumbling.http_client import create_client_session, get_timeout
+
+
+def test_create_client_session():
+    async def create_and_close():
+        session = create_client_session({"limitPerHost": 3, "totalTimeout": 7})
+        try:
+            return session.connector.limit_per_host, session.timeout
+        finally:
+            await session.close()
+
+    limit_per_host, timeout = asyncio.run(create_and_close())
+    assert limit_per_host == 3
+    assert timeout.total == 7
+    assert timeout.connect == 5
+
+
+def test_get_timeout():
+    async def create_and_close():
+        session = create_client_session({"totalTimeout": 7, "connectTimeout": 2})
+        try:
+            return get_timeout(session, 3), get_timeout(session, 10)
+        finally:
+            await session.close()
+
+    short_timeout, long_timeout = asyncio.run(create_and_close())
+    # the connect timeout of the session is kept
+    assert (short_timeout.total, short_timeout.connect) == (3, 2)
+    assert (long_timeout.total, long_timeout.connect) == (7, 2)
+    assert get_timeout(None, 3).sock_connect == 30
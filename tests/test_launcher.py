@@ -0,0 +1,28 @@
+from thumbling import launcher
+from thumbling.launcher import create_socket
+
+
+def test_create_socket_shared_port():
+    first = create_socket("127.0.0.1", 0)
+    port = first.getsockname()[1]
+    # a second worker can listen on the same port
+    second = create_socket("127.0.0.1", port)
+    assert second.getsockname()[1] == port
+    first.close()
+    second.close()
+
+
+def test_single_worker_stays_in_the_foreground(monkeypatch):
+    calls = []
+
+    def run_app(app, sock, **kwargs):
+        calls.append(sock.getsockname()[1])
+        sock.close()
+
+    def setpgrp():
+        calls.append("setpgrp")
+
+    monkeypatch.setattr(launcher.web, "run_app", run_app)
+    monkeypatch.setattr(launcher.os, "setpgrp", setpgrp)
+    launcher.main(["--host", "127.0.0.1", "--port", "0", "--workers", "1"])
+    assert len(calls) == 1 and calls[0] != "setpgrp"
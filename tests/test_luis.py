@@ -0,0 +1,49 @@
+import asyncio
+
+from thumbling.luis import IntentCache, get_message_intent, normalize_sentence
+
+
+def test_normalize_sentence():
+    assert normalize_sentence("  Is  euler\tdown today? ") == "is euler down today"
+
+
+def test_intent_cache():
+    cache = IntentCache(ttl=3600)
+    message_intent = {"topScoringIntent": {"intent": "problem"}, "entities": []}
+    key = cache.get_key("Problems with euler?")
+    assert key == cache.get_key("problems  with EULER")
+    assert cache.get(key) is None
+
+    cache.set(key, message_intent, latency=0.25)
+    assert cache.get(key) is message_intent
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 1,
+        "misses": 1,
+        "hit_rate": 0.5,
+        "saved_latency": 0.25,
+    }
+
+
+def test_intent_cache_time_sensitive_ttl():
+    cache = IntentCache(ttl=3600)
+    cache.cache.clock = lambda: 0
+    message_intent = {
+        "entities": [{"type": "builtin.datetimeV2.datetimerange", "entity": "1h"}]
+    }
+    key = cache.get_key("problems in the last hour")
+    cache.set(key, message_intent, latency=0.1)
+    cache.cache.clock = lambda: 61
+    assert cache.get(key) is None
+
+
+def test_get_message_intent_from_cache():
+    cache = IntentCache()
+    message_intent = {"topScoringIntent": {"intent": "problem"}, "entities": []}
+    cache.set(cache.get_key("problems with euler"), message_intent, latency=0.1)
+    # the cached result is returned without a request to LUIS
+    service_config = {"appId": "", "subscriptionKey": ""}
+    result = asyncio.run(
+        get_message_intent(service_config, "Problems with euler?", cache=cache)
+    )
+    assert result is message_intent
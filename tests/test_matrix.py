@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+from thumbling.matrix import (
+    AlertSeries,
+    AlertSummary,
+    MatrixDecodeError,
+    iter_matrix_series,
+    stitch_series,
+    summarize_series,
+)
+from thumbling.resilience import is_retryable
+
+
+class ChunkedStream:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.position = 0
+
+    async def read(self, n: int) -> bytes:
+        chunk = self.body[self.position : self.position + n]
+        self.position += len(chunk)
+        return chunk
+
+
+def decode_all(body: bytes, chunk_size: int) -> list:
+    async def decode():
+        stream = ChunkedStream(body)
+        return [s async for s in iter_matrix_series(stream, chunk_size=chunk_size)]
+
+    return asyncio.run(decode())
+
+
+RESULT = [
+    {
+        "metric": {"alertname": "ServiceDown", "instance": "euler-p1", "note": "ä]}"},
+        "values": [[1540251900 + 60 * i, "1"] for i in range(100)],
+    },
+    {"metric": {"alertname": "SlowAnswerTimes"}, "values": [[1540251900, "1"]]},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_iter_matrix_series(chunk_size):
+    body = json.dumps(
+        {"status": "success", "data": {"resultType": "matrix", "result": RESULT}},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    assert decode_all(body, chunk_size) == RESULT
+    empty_body = b'{"status":"success","data":{"resultType":"matrix","result":[ ]}}'
+    assert decode_all(empty_body, chunk_size) == []
+
+
+def test_iter_matrix_series_invalid_body():
+    with pytest.raises(MatrixDecodeError):
+        decode_all(b'{"status":"error","error":"bad_data"}', 16)
+    with pytest.raises(MatrixDecodeError):
+        decode_all(b'{"data":{"result":[{"metric":{}, "values":[[1,', 16)
+    # e.g. the login page of a proxy is no backend failure
+    assert not is_retryable(MatrixDecodeError("the response body is not valid JSON"))
+
+
+def test_alert_series_from_dict():
+    series = AlertSeries.from_dict(RESULT[0])
+    assert series.labels == (
+        ("alertname", "ServiceDown"),
+        ("instance", "euler-p1"),
+        ("note", "ä]}"),
+    )
+    assert series.metric == RESULT[0]["metric"]
+    assert len(series) == 100
+    assert series.timestamps.typecode == "d"
+    assert series.timestamps[-1] == 1540251900 + 60 * 99
+    assert set(series.values) == {1.0}
+
+
+def test_summarize_series():
+    series = {
+        "metric": {"alertname": "ServiceDown"},
+        "values": [[100, "1"], [160, "1"], [220, "1"], [400, "1"], [460, "1"]],
+    }
+    assert summarize_series(series, step=60) == AlertSummary(
+        (("alertname", "ServiceDown"),), 100, 460, 5, [(100, 220), (400, 460)]
+    )
+    assert summarize_series({"metric": {}, "values": []}).episodes == []
+
+
+def test_stitch_series_summaries():
+    labels = (("alertname", "ServiceDown"),)
+    parts = [
+        AlertSummary(labels, 100, 400, 3, [(100, 160), (400, 400)]),
+        AlertSummary(labels, 460, 700, 3, [(460, 520), (700, 700)]),
+    ]
+    assert stitch_series(parts, step=60) == AlertSummary(
+        labels, 100, 700, 6, [(100, 160), (400, 520), (700, 700)]
+    )
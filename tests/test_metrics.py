@@ -0,0 +1,50 @@
+from thumbling.cache import TTLCache
+from thumbling.luis import IntentCache
+from thumbling.metrics import BotMetrics, Counter, Histogram
+
+
+def test_histogram():
+    histogram = Histogram("duration_seconds", "Duration.", ("stage",), (0.1, 1.0))
+    histogram.observe(0.05, "luis")
+    histogram.observe(0.1, "luis")
+    histogram.observe(0.5, "luis")
+    histogram.observe(2, "luis")
+    assert list(histogram.collect()) == [
+        "# HELP duration_seconds Duration.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{stage="luis",le="0.1"} 2',
+        'duration_seconds_bucket{stage="luis",le="1.0"} 3',
+        'duration_seconds_bucket{stage="luis",le="+Inf"} 4',
+        'duration_seconds_sum{stage="luis"} 2.65',
+        'duration_seconds_count{stage="luis"} 4',
+    ]
+
+
+def test_counter_label_escaping():
+    counter = Counter("intents_total", "Intents.", ("intent",))
+    counter.inc('say "hi"')
+    counter.inc('say "hi"')
+    assert list(counter.collect())[2] == 'intents_total{intent="say \\"hi\\""} 2'
+
+
+def test_bot_metrics_render():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.get("a")
+    intent_cache = IntentCache()
+    key = intent_cache.get_key("problems with euler?")
+    intent_cache.set(key, {"entities": []}, 0.25)
+    intent_cache.get(key)
+    intent_cache.get(intent_cache.get_key("hello"))
+    metrics = BotMetrics({"queries": cache, "intents": intent_cache, "none": None})
+    with metrics.turn_duration.time():
+        metrics.turns_in_flight.inc()
+    text = metrics.render()
+    assert "thumbling_turn_duration_seconds_count 1\n" in text
+    assert "thumbling_turns_in_flight 1\n" in text
+    assert 'thumbling_cache_entries{cache="queries"} 1\n' in text
+    assert 'thumbling_cache_hits_total{cache="queries"} 1\n' in text
+    assert 'thumbling_cache_hit_ratio{cache="intents"} 0.5\n' in text
+    assert 'thumbling_cache_saved_seconds_total{cache="intents"} 0.25\n' in text
+    assert 'saved_seconds_total{cache="queries"}' not in text
+    assert 'cache="none"' not in text
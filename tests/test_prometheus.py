@@ -0,0 +1,271 @@
+import asyncio
+from datetime import datetime
+import re
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+from thumbling.cache import TTLCache
+from thumbling.matrix import AlertSeries, AlertSummary
+from thumbling.prometheus import (
+    LatencyTracker,
+    PrometheusAPI,
+    duration2seconds,
+    get_query_step,
+    get_alert_queries,
+    get_coalesced_alert_queries,
+    get_query_time_ranges,
+    merge_replica_results,
+    merge_time_ranges,
+    split_result_by_label,
+)
+from thumbling.singleflight import SingleFlight
+from thumbling.utils import str2timestamp
+
+
+def test_get_alert_queries():
+    entities = [
+        {"type": "service-name", "entity": "euler"},
+        {"type": "instance", "entity": "euler - p1"},
+        {"type": "instance", "entity": 'gauss"s1'},
+    ]
+    assert get_alert_queries(entities) == [
+        'ALERTS{instance="euler-p1"}',
+        'ALERTS{instance="gauss\\"s1"}',
+    ]
+    assert get_alert_queries(entities[:1]) == ['ALERTS{service="euler"}']
+    assert get_alert_queries([]) == []
+
+
+def test_get_coalesced_alert_queries():
+    values = ["euler-p1", "euler.s1", "euler-p1", "gauss-p2"]
+    queries = get_coalesced_alert_queries("instance", values, max_selector_length=24)
+    assert queries == [
+        ('ALERTS{instance=~"euler\\\\-p1|euler\\\\.s1"}', ["euler-p1", "euler.s1"]),
+        ('ALERTS{instance="gauss-p2"}', ["gauss-p2"]),
+    ]
+    # the regex must match the values exactly, as Prometheus anchors it
+    regex = queries[0][0].split('"')[1].replace("\\\\", "\\")
+    assert re.fullmatch(regex, "euler.s1")
+    assert not re.fullmatch(regex, "euler-s1")
+
+
+def test_split_result_by_label():
+    result = [
+        AlertSeries.from_dict({"metric": metric, "values": []})
+        for metric in [
+            {"instance": "euler-p1", "alertname": "ServiceDown"},
+            {"instance": "euler-s1", "alertname": "SlowAnswerTimes"},
+            {"instance": "euler-p1", "alertname": "SlowAnswerTimes"},
+            {"instance": "gauss-p1", "alertname": "ServiceDown"},
+        ]
+    ]
+    assert split_result_by_label(result, "instance", ["euler-p1", "euler-s1"]) == {
+        "euler-p1": [result[0], result[2]],
+        "euler-s1": [result[1]],
+    }
+
+
+def test_merge_time_ranges():
+    time_ranges = [(50, 60), (0, 10), (5, 20), (20, 30), (8, 9), (61, 70)]
+    assert merge_time_ranges(time_ranges) == [(0, 30), (50, 60), (61, 70)]
+    assert merge_time_ranges(time_ranges, max_gap=1) == [(0, 30), (50, 70)]
+    assert merge_time_ranges([]) == []
+
+
+def test_get_query_time_ranges_merged():
+    date_values = [{"value": "2018-10-23"}, {"value": "2018-10-23"}]
+    daterange_values = [{"start": "2018-10-23T09:00:00", "end": "2018-10-24T09:00:00"}]
+    entities = [
+        {"type": "builtin.datetimeV2.date", "resolution": {"values": date_values}},
+        {
+            "type": "builtin.datetimeV2.daterange",
+            "resolution": {"values": daterange_values},
+        },
+    ]
+    start = int(datetime(2018, 10, 23).timestamp())
+    end = str2timestamp("2018-10-24T09:00:00")
+    assert get_query_time_ranges(entities) == [(start, end)]
+
+
+def test_duration2seconds():
+    assert duration2seconds("1m") == 60
+    assert duration2seconds("1h30m") == 5400
+    assert duration2seconds("15") == 15
+    assert duration2seconds("250ms") == 0.25
+
+
+def run_with_fake_prometheus(test_coroutine, replicas: list = None):
+    """ run the test coroutine with the URL of a fake Prometheus and its requests
+
+    With replicas, a list of (delay, series values) tuples, a fake Prometheus is
+    started for each replica and the test coroutine gets a list of their URLs.
+    """
+    requests = []
+
+    def create_app(delay: float, values: list) -> web.Application:
+        async def query_range(request):
+            requests.append(dict(request.rel_url.query))
+            await asyncio.sleep(delay)
+            series = {"metric": {"alertname": "ServiceDown"}, "values": values}
+            data = {"resultType": "matrix", "result": [series]}
+            return web.json_response({"status": "success", "data": data})
+
+        app = web.Application()
+        app.add_routes([web.get("/api/v1/query_range", query_range)])
+        return app
+
+    async def run():
+        servers = [
+            TestServer(create_app(delay, values))
+            for delay, values in replicas or [(0, [[960, "1"]])]
+        ]
+        for server in servers:
+            await server.start_server()
+        try:
+            urls = [str(server.make_url("/")) for server in servers]
+            return await test_coroutine(urls if replicas else urls[0], requests)
+        finally:
+            for server in servers:
+                await server.close()
+
+    return asyncio.run(run())
+
+
+def test_query_range_cache():
+    async def query(url, requests):
+        cache = TTLCache()
+        api = PrometheusAPI({"endpoint": url}, cache=cache)
+        now = int(time.time())
+        for start, end in [(1000, 2000), (1010, 2030), (now - 3600, now)] * 2:
+            await api.query_range("ALERTS", start=start, end=end)
+        return cache, requests
+
+    cache, requests = run_with_fake_prometheus(query)
+    assert len(requests) == 2
+    assert (requests[0]["start"], requests[0]["end"]) == ("960", "1980")
+    assert cache.stats() == {"size": 2, "hits": 4, "misses": 2}
+
+
+def test_query_range_singleflight():
+    async def query(url, requests):
+        singleflight = SingleFlight()
+        apis = [
+            PrometheusAPI({"endpoint": url}, singleflight=singleflight)
+            for _ in range(3)
+        ]
+        results = await asyncio.gather(
+            *(api.query_range("ALERTS", start=1000, end=2000) for api in apis)
+        )
+        return singleflight, results, requests
+
+    singleflight, results, requests = run_with_fake_prometheus(query)
+    assert len(requests) == 1
+    assert results[0] is results[1] is results[2]
+    assert singleflight.stats() == {"in_flight": 0, "started": 1, "collapsed": 2}
+
+
+def test_get_query_step():
+    assert get_query_step(0, 86400) == "1m"
+    assert get_query_step(0, 7 * 86400) == "10m"
+    assert get_query_step(0, 7 * 86400, max_points=100) == "2h"
+    assert get_query_step(0, 1000 * 86400) == "1d"
+
+
+def test_query_range_adaptive_step_and_deadline():
+    async def query(url, requests):
+        api = PrometheusAPI({"endpoint": url, "maxPointsPerSeries": 100})
+        await api.query_range(
+            "ALERTS", start=0, end=86400, deadline=time.monotonic() + 5
+        )
+        with pytest.raises(asyncio.TimeoutError):
+            await api.query_range("ALERTS", start=0, end=86400, deadline=0)
+        return requests
+
+    requests = run_with_fake_prometheus(query)
+    assert len(requests) == 1
+    assert requests[0]["step"] == "15m"
+    assert 0 < float(requests[0]["timeout"]) <= 5
+
+
+def test_query_range_stream_responses():
+    async def query(url, requests):
+        results = []
+        for stream_responses in [False, True]:
+            config = {"endpoint": url, "streamResponses": stream_responses}
+            api = PrometheusAPI(config)
+            result = await api.query_range("ALERTS", start=1000, end=2000)
+            results.append(result["data"]["result"])
+        return results
+
+    series_result, summary_result = run_with_fake_prometheus(query)
+    labels = (("alertname", "ServiceDown"),)
+    assert [(s.labels, list(s.timestamps)) for s in series_result] == [(labels, [960])]
+    assert summary_result == [AlertSummary(labels, 960, 960, 1, [(960, 960)])]
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(window_size=10, min_samples=5)
+    for latency in [0.4, 0.1, 0.3]:
+        tracker.record(latency)
+    assert tracker.get_percentile(0.9, default=1.0) == 1.0
+    for latency in [0.2, 0.5, 0.6]:
+        tracker.record(latency)
+    assert tracker.get_percentile(0.5, default=1.0) == 0.4
+    assert tracker.get_percentile(0.99, default=1.0) == 0.6
+
+
+def test_query_range_hedged():
+    async def query(urls, requests):
+        config = {"endpoint": "", "endpoints": urls, "hedgeDelay": 0.05}
+        api = PrometheusAPI(config)
+        started = time.monotonic()
+        result = await api.query_range("ALERTS", start=1000, end=2000)
+        return result, time.monotonic() - started
+
+    replicas = [(1, [[960, "1"]]), (0, [[960, "1"], [1020, "1"]])]
+    result, duration = run_with_fake_prometheus(query, replicas)
+    assert len(result["data"]["result"][0]) == 2
+    assert duration < 0.5
+
+
+def test_query_range_merged():
+    async def query(urls, requests):
+        config = {
+            "endpoint": "",
+            "endpoints": urls,
+            "replicaMode": "merge",
+            "streamResponses": True,
+        }
+        api = PrometheusAPI(config)
+        return await api.query_range("ALERTS", start=1000, end=2000), requests
+
+    replicas = [(0, [[960, "1"]]), (0, [[960, "1"], [1020, "1"]])]
+    result, requests = run_with_fake_prometheus(query, replicas)
+    assert len(requests) == 2
+    assert [len(series) for series in result["data"]["result"]] == [2]
+
+
+def test_merge_replica_results():
+    def series(labels: dict, values: list) -> AlertSeries:
+        return AlertSeries.from_dict({"metric": labels, "values": values})
+
+    results = [
+        {"status": "success", "data": {"result": [series({"replica": "a"}, [])]}},
+        {
+            "status": "success",
+            "data": {
+                "result": [
+                    series({"replica": "b"}, [[960, "1"]]),
+                    series({"replica": "b", "instance": "euler-p1"}, []),
+                ]
+            },
+        },
+    ]
+    merged = merge_replica_results(results, {"replica"})["data"]["result"]
+    assert [(s.labels, len(s)) for s in merged] == [
+        ((), 1),
+        ((("instance", "euler-p1"),), 0),
+    ]
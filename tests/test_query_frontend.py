@@ -0,0 +1,56 @@
+import asyncio
+
+from thumbling.matrix import AlertSeries
+from thumbling.query_frontend import QueryFrontend, get_shard_ranges
+
+
+def test_get_shard_ranges():
+    assert get_shard_ranges(0, 1000, 60, 86400) == [(0, 1000)]
+    assert get_shard_ranges(86100, 86400 * 2 + 120, 60, 86400) == [
+        (86100, 86340),
+        (86400, 172740),
+        (172800, 172920),
+    ]
+    # the evaluation timestamps do not have to match the shard borders
+    assert get_shard_ranges(86100, 86940, 420, 86400) == [
+        (86100, 86100),
+        (86520, 86940),
+    ]
+
+
+class FakePrometheusAPI:
+    def __init__(self):
+        self.queries = []
+
+    def get_query_step(self, start, end):
+        return "1m"
+
+    async def query_range(self, query_string, start, end, step, timeout, deadline):
+        self.queries.append((start, end, step))
+        timestamps = range(start, end + 1, 60)
+        values = [[timestamp, "1"] for timestamp in timestamps]
+        series = [
+            AlertSeries.from_dict({"metric": {"instance": instance}, "values": values})
+            for instance in ["euler-p1", "euler-p2"]
+            # euler-p2 is only firing in the last shard
+            if instance == "euler-p1" or start > 86400
+        ]
+        data = {"resultType": "matrix", "result": series}
+        return {"status": "success", "data": data}
+
+
+def test_query_frontend_query_range():
+    api = FakePrometheusAPI()
+    frontend = QueryFrontend(api, {"maxConcurrentShards": 2})
+    result = asyncio.run(frontend.query_range("ALERTS", 86100, 86400 * 2 + 130))
+    assert api.queries == [
+        (86100, 86340, "1m"),
+        (86400, 172740, "1m"),
+        (172800, 172920, "1m"),
+    ]
+    p1, p2 = result["data"]["result"]
+    assert p1.metric == {"instance": "euler-p1"}
+    assert list(p1.timestamps) == list(range(86100, 172921, 60))
+    assert p1.get_episodes(60) == [(86100, 172920)]
+    assert p2.metric == {"instance": "euler-p2"}
+    assert list(p2.timestamps) == list(range(172800, 172921, 60))
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from thumbling.prometheus import get_alert_selectors, get_query_time_ranges
+from thumbling.recognizer import LocalRecognizer, parse_time
+
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+@pytest.fixture
+def recognizer():
+    return LocalRecognizer(["euler", "euler-api", "gauss"])
+
+
+def test_recognize_instances_and_date(recognizer):
+    message_intent = recognizer.recognize("Any problems with Euler - P1 today?", NOW)
+    assert message_intent["topScoringIntent"] == {"intent": "problem", "score": 1.0}
+    entities = message_intent["entities"]
+    assert get_alert_selectors(entities) == ("instance", ["euler-p1"])
+    assert entities[1]["type"] == "builtin.datetimeV2.date"
+    assert entities[1]["resolution"]["values"] == [
+        {"timex": "2026-10-18", "type": "date", "value": "2026-10-18"}
+    ]
+
+
+def test_recognize_services_and_relative_range(recognizer):
+    message_intent = recognizer.recognize(
+        "was euler-api or gauss down in the last 2 hours", NOW
+    )
+    entities = message_intent["entities"]
+    assert get_alert_selectors(entities) == ("service", ["euler-api", "gauss"])
+    assert entities[2]["resolution"]["values"] == [
+        {
+            "type": "datetimerange",
+            "start": "2026-10-18 10:00:00",
+            "end": "2026-10-18 12:00:00",
+        }
+    ]
+    assert recognizer.recognized == 1
+
+    message_intent = recognizer.recognize("was gauss down in the last hour")
+    assert len(get_query_time_ranges(message_intent["entities"])) == 1
+
+
+@pytest.mark.parametrize(
+    "sentence",
+    [
+        "hello",
+        "what about euler",
+        "no problems with euler at 9",
+        "problems with euler since monday",
+        # date ranges of calendar days in LUIS
+        "problems with euler during the last week",
+        "was euler down the past day",
+        "was gauss down in the last 2 days",
+        "any issues with euler in the past 3 weeks",
+        # one datetime in LUIS
+        "problems with euler today at 9:00",
+    ],
+)
+def test_recognize_falls_back(recognizer, sentence):
+    assert recognizer.recognize(sentence, NOW) is None
+    assert recognizer.fallbacks == 1
+
+
+def test_parse_time():
+    assert parse_time("9", "30", None) == "09:30:00"
+    assert parse_time("3", None, "PM") == "15:00:00"
+    assert parse_time("12", None, "am") == "00:00:00"
+    assert parse_time("9", None, None) is None
+    assert parse_time("25", "00", None) is None
@@ -0,0 +1,120 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+import pytest
+
+from thumbling.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    ResiliencePolicy,
+)
+
+
+def test_circuit_breaker(clock):
+    breaker = CircuitBreaker("prometheus", 2, 30, clock=clock)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now = 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    # only one trial call is allowed while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 60
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def create_request(errors: list):
+    calls = []
+
+    async def request(request_deadline: float = None):
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "result"
+
+    return request, calls
+
+
+def test_resilience_policy_retries():
+    policy = ResiliencePolicy("luis", {"retries": 2, "retryBaseDelay": 0.001})
+    request, calls = create_request([aiohttp.ServerDisconnectedError()] * 2)
+    assert asyncio.run(policy.call(request)) == "result"
+    assert len(calls) == 3
+
+    request, calls = create_request([aiohttp.ServerDisconnectedError()] * 3)
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        asyncio.run(policy.call(request))
+    assert len(calls) == 3
+
+    # errors of the request itself are not retried
+    request, calls = create_request([ValueError()])
+    with pytest.raises(ValueError):
+        asyncio.run(policy.call(request))
+    assert len(calls) == 1
+
+
+def test_resilience_policy_circuit_and_deadline(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    config = {"retries": 5, "retryBaseDelay": 10, "failureThreshold": 1}
+    policy = ResiliencePolicy("prometheus", config)
+    request, calls = create_request([asyncio.TimeoutError()])
+    deadline = time.monotonic() + 0.1
+    # the backoff delay would exceed the deadline, so the error is raised at once
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(policy.call(request, deadline))
+    assert len(calls) == 1
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.call(request))
+    assert len(calls) == 1
+
+
+async def hanging_request(request_deadline: float):
+    # the backend does not answer, the request times out at its deadline
+    await asyncio.wait_for(asyncio.sleep(10), request_deadline - time.monotonic())
+
+
+def test_resilience_policy_hanging_backend_opens_circuit():
+    config = {"retries": 0, "failureThreshold": 2, "requestTimeout": 0.02}
+    policy = ResiliencePolicy("prometheus", config)
+
+    async def run():
+        for _ in range(2):
+            # the attempts end before the deadline, so the backend failed
+            with pytest.raises(asyncio.TimeoutError) as error_info:
+                await policy.call(hanging_request, time.monotonic() + 0.3)
+            assert not isinstance(error_info.value, DeadlineExceededError)
+        with pytest.raises(CircuitOpenError):
+            await policy.call(hanging_request, time.monotonic() + 0.3)
+
+    asyncio.run(run())
+    assert policy.circuit_breaker.state == CircuitBreaker.OPEN
+
+
+def test_resilience_policy_deadline_is_no_backend_failure():
+    config = {"failureThreshold": 1, "requestTimeout": 1}
+    policy = ResiliencePolicy("prometheus", config)
+
+    async def run():
+        # the attempt is shortened by the deadline of the turn
+        with pytest.raises(DeadlineExceededError):
+            await policy.call(hanging_request, time.monotonic() + 0.02)
+        with pytest.raises(DeadlineExceededError):
+            await policy.call(hanging_request, time.monotonic() - 1)
+
+    asyncio.run(run())
+    assert policy.circuit_breaker.state == CircuitBreaker.CLOSED
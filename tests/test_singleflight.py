@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from thumbling.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_collapsed():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) > 1:
+            raise ValueError("backend error")
+        return {"status": "success"}
+
+    async def run():
+        singleflight = SingleFlight()
+        results = await asyncio.gather(
+            *(singleflight.do("ALERTS", call) for _ in range(3))
+        )
+        assert results == [{"status": "success"}] * 3
+        assert len(singleflight) == 0
+        # the error of a later call is shared by its callers as well
+        errors = await asyncio.gather(
+            *(singleflight.do("ALERTS", call) for _ in range(2)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(error, ValueError) for error in errors)
+        return singleflight
+
+    singleflight = asyncio.run(run())
+    assert len(calls) == 2
+    assert singleflight.stats() == {"in_flight": 0, "started": 2, "collapsed": 3}
+
+
+def test_cancelled_callers():
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(0.02)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "result"
+
+    async def run():
+        singleflight = SingleFlight()
+        first = asyncio.ensure_future(singleflight.do("key", call))
+        second = asyncio.ensure_future(singleflight.do("key", call))
+        await asyncio.sleep(0)
+        # the call goes on for the remaining caller
+        first.cancel()
+        assert await second == "result"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        # and is cancelled when its last caller is cancelled
+        only = asyncio.ensure_future(singleflight.do("key", call))
+        await asyncio.sleep(0)
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        assert len(singleflight) == 0
+        assert await singleflight.do("key", call) == "result"
+
+    asyncio.run(run())
+    assert cancelled == [1]
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from thumbling import tracing
+
+
+def test_turn_spans_nested_and_exported(tmp_path, caplog):
+    export_path = tmp_path / "traces.json"
+    tracer = tracing.Tracer({"exportPath": str(export_path)})
+
+    async def query(name: str):
+        with tracing.span("query_range", query=name):
+            await asyncio.sleep(0.01)
+
+    async def run():
+        with tracer.turn("activity-1", conversation="conversation") as trace:
+            with tracing.span("get_message_intent"):
+                pass
+            await asyncio.gather(query("a"), query("b"))
+            with pytest.raises(ValueError):
+                with tracing.span("send_activity"):
+                    raise ValueError("no channel")
+        return trace
+
+    with caplog.at_level(logging.INFO, logger="thumbling.tracing"):
+        trace = asyncio.run(run())
+
+    turn, *stages = trace.spans
+    assert [span.name for span in stages] == [
+        "get_message_intent",
+        "query_range",
+        "query_range",
+        "send_activity",
+    ]
+    assert all(span.parent_id == turn.span_id for span in stages)
+    assert stages[-1].error == "ValueError"
+    assert stages[1].end_time - stages[1].start_time >= 10 ** 7
+    assert caplog.records[0].turn_id == "activity-1"
+
+    (line,) = export_path.read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {span["traceId"] for span in spans} == {trace.trace_id}
+    assert "parentSpanId" not in spans[0]
+    assert spans[0]["attributes"][1] == {
+        "key": "conversation",
+        "value": {"stringValue": "conversation"},
+    }
+    assert spans[4]["status"] == {"code": 2, "message": "ValueError"}
+
+
+def test_span_outside_of_turn():
+    with tracing.span("query_range") as span:
+        assert span is None
+    with tracing.Tracer({"enabled": False}).turn("activity-1") as trace:
+        assert trace is None
+        assert tracing.CURRENT_SPAN.get() is None
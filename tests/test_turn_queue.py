@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from thumbling.turn_queue import QueueFullError, TurnQueue
+
+
+class FakeAdapter:
+    async def continue_conversation(self, reference, callback, claims_identity=None):
+        context = SimpleNamespace(activity=None, reference=reference)
+        await callback(context)
+
+
+def create_context(text: str) -> SimpleNamespace:
+    activity = Activity(
+        type="message",
+        id=text,
+        text=text,
+        channel_id="test",
+        conversation=ConversationAccount(id="conversation"),
+        from_property=ChannelAccount(id="user"),
+        recipient=ChannelAccount(id="bot"),
+        service_url="http://localhost",
+    )
+    return SimpleNamespace(activity=activity, turn_state={})
+
+
+def test_turn_queue_bounded_and_drained():
+    handled = []
+
+    async def handler(context):
+        await asyncio.sleep(0.01)
+        if context.activity.text == "broken":
+            raise ValueError("broken turn")
+        handled.append((context.activity.text, context.reference.conversation.id))
+
+    async def run():
+        turn_queue = TurnQueue(
+            FakeAdapter(), handler, {"maxQueuedTurns": 3, "turnWorkers": 1}
+        )
+        for text in ["first", "broken", "second"]:
+            await turn_queue.submit(create_context(text))
+        assert turn_queue.full()
+        with pytest.raises(QueueFullError):
+            await turn_queue.submit(create_context("too many"))
+
+        turn_queue.start()
+        await turn_queue.stop()
+        assert turn_queue.queue.empty()
+
+    asyncio.run(run())
+    # a failing turn does not stop the worker
+    assert handled == [("first", "conversation"), ("second", "conversation")]
@@ -2,7 +2,14 @@ import json
 
 import pytest
 
-from thumbling.utils import decrypt_string, load_bot_file, get_service_config
+from thumbling.utils import (
+    BotConfigError,
+    decrypt_string,
+    load_bot_file,
+    get_service_config,
+    get_optional_service_config,
+    str2timestamp,
+)
 
 
 @pytest.fixture
@@ -149,3 +156,20 @@ def test_get_service_config(bot_file_config, input, id_in_list_of_expected):
     _, decrypted_config, _ = bot_file_config
     result = get_service_config(decrypted_config["services"], *input)
     assert result == decrypted_config["services"][id_in_list_of_expected]
+
+
+def test_get_optional_service_config(bot_file_config):
+    _, decrypted_config, _ = bot_file_config
+    custom_services = decrypted_config["custom_services"]
+    result = get_optional_service_config(custom_services, "prometheus", "development")
+    assert result == custom_services[0]
+    assert get_optional_service_config(custom_services, "http_client", "dev") == {}
+    with pytest.raises(BotConfigError):
+        get_optional_service_config(custom_services * 2, "prometheus", "development")
+
+
+def test_str2timestamp():
+    assert str2timestamp("1540000000") == 1540000000
+    assert str2timestamp("2018-10-24T09:00:00") == 1540371600
+    assert str2timestamp("2018-10-24 11:00:00+02:00") == 1540371600
+    assert str2timestamp("2018-10-24T09:00:00Z") == 1540371600